@@ -0,0 +1,278 @@
+import os
+import cv2
+import json
+import math
+import time
+import bisect
+import shutil
+import platform
+import tempfile
+import multiprocessing
+from datetime import datetime
+from utils import configurar_hilos_opencv
+from bounded_memory import procesar_rango
+from video_decoding import obtener_info_video, dimensiones_escaladas, listar_keyframes
+
+FRAMES_POR_MUESTRA = 8       # Frames consecutivos de cada ventana de calibración
+MUESTRAS_POR_PROCESO = 2     # Ventanas de calibración que recibe cada proceso
+HILOS_OPENCV_CANDIDATOS = (1, 2, 4)
+OBJETIVO_SEGUNDOS_CHUNK = 10  # Duración buscada de cada chunk para amortizar la búsqueda inicial
+CHUNKS_POR_PROCESO = 4        # Chunks mínimos por proceso para balancear la carga al final
+MIN_FRAMES_CHUNK = 30
+
+
+def ruta_cache():
+    """
+    Devuelve la ruta del archivo donde se persisten las configuraciones calibradas.
+
+    Returns:
+        str: Ruta del archivo JSON de configuraciones.
+    """
+    base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'qrDetector', 'autotuning.json')
+
+
+def nucleos_disponibles():
+    """
+    Calcula los núcleos que el proceso puede usar, considerando la afinidad de CPU y la cuota de cgroup.
+
+    Returns:
+        int: Cantidad de núcleos disponibles.
+    """
+    try:
+        nucleos = len(os.sched_getaffinity(0))
+    except AttributeError:
+        nucleos = os.cpu_count() or 1
+
+    cuota = None
+    try:
+        # cgroup v2: "max 100000" o "<cuota> <periodo>"
+        with open('/sys/fs/cgroup/cpu.max') as archivo:
+            limite, periodo = archivo.read().split()
+        if limite != 'max':
+            cuota = int(limite) / int(periodo)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1: una cuota de -1 indica que no hay límite
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as archivo:
+                limite = int(archivo.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as archivo:
+                periodo = int(archivo.read())
+            if limite > 0:
+                cuota = limite / periodo
+        except (OSError, ValueError):
+            pass
+
+    if cuota is not None:
+        nucleos = min(nucleos, max(1, math.ceil(cuota)))
+    return nucleos
+
+
+def clave_maquina():
+    """
+    Identifica la máquina para la persistencia de la calibración.
+
+    Returns:
+        str: Nombre del host junto con los núcleos disponibles.
+    """
+    return f"{platform.node()}-{nucleos_disponibles()}c"
+
+
+def perfil_video(video_path: str, modo: str, backend: str = 'opencv', escala: float = 1.0, hilos_parches: int = 1):
+    """
+    Resume las características del video que determinan el costo por frame.
+
+    Args:
+        video_path (str): Ruta al archivo de video.
+        modo (str): Modo de procesamiento.
+        backend (str): Backend de decodificación.
+        escala (float): Factor de escala aplicado durante la decodificación.
+        hilos_parches (int): Hilos por proceso que decodifican los parches de cada frame (modo híbrido).
+
+    Returns:
+        str: Clave del perfil, por ejemplo 'hibrido-opencv-1920x1080-avc1' o 'hibrido-opencv-1920x1080-avc1-4hilos'.
+    """
+    info = obtener_info_video(video_path)
+    ancho, alto = dimensiones_escaladas(info['ancho'], info['alto'], escala)
+
+    cap = cv2.VideoCapture(video_path)
+    fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+    cap.release()
+    codec = ''.join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4)).strip('\x00 ') or 'desconocido'
+
+    perfil = f"{modo}-{backend}-{ancho}x{alto}-{codec}"
+    if modo == 'hibrido' and hilos_parches > 1:
+        perfil += f"-{hilos_parches}hilos"
+    return perfil
+
+
+def _ventanas_muestra(total_frames: int, cantidad: int, keyframes: list = None):
+    """
+    Reparte ventanas de calibración a lo largo del video, cada una desde un keyframe para que se mida el
+    procesamiento de sus frames y no la decodificación de los frames previos. Sin keyframes las ventanas se toman
+    seguidas desde el inicio del video.
+    """
+    if keyframes:
+        paso = total_frames / cantidad
+        inicios = [keyframes[max(0, bisect.bisect_right(keyframes, int(i * paso)) - 1)] for i in range(cantidad)]
+    else:
+        inicios = [i * FRAMES_POR_MUESTRA for i in range(cantidad)]
+    inicios = [min(inicio, max(0, total_frames - FRAMES_POR_MUESTRA)) for inicio in inicios]
+    return [(inicio, min(inicio + FRAMES_POR_MUESTRA, total_frames)) for inicio in inicios]
+
+
+def medir_configuracion(video_path: str, modo: str, procesos: int, hilos_opencv: int, backend: str = 'opencv',
+                        escala: float = 1.0, hilos: int = 0, hilos_parches: int = 1):
+    """
+    Mide el rendimiento de una combinación de procesos e hilos de OpenCV sobre una muestra del video.
+
+    Args:
+        video_path (str): Ruta al archivo de video.
+        modo (str): Modo de procesamiento ('hibrido' o 'pyzbar').
+        procesos (int): Cantidad de procesos.
+        hilos_opencv (int): Hilos internos de OpenCV en cada proceso.
+        backend (str): Backend de decodificación.
+        escala (float): Factor de escala aplicado durante la decodificación.
+        hilos (int): Hilos del decodificador.
+        hilos_parches (int): Hilos por proceso que decodifican los parches de cada frame (modo híbrido).
+
+    Returns:
+        float: Frames procesados por segundo en total.
+    """
+    total_frames = obtener_info_video(video_path)['total_frames']
+    directorio = tempfile.mkdtemp(prefix='qr_autotuning_')
+    log_path = os.path.join(directorio, 'log.txt')
+
+    try:
+        keyframes = listar_keyframes(video_path)
+    except ImportError:
+        keyframes = None
+    ventanas = _ventanas_muestra(total_frames, procesos * MUESTRAS_POR_PROCESO, keyframes)
+
+    def tareas(ventanas):
+        return [(modo, video_path, log_path, directorio, start, end, backend, escala, hilos, None, hilos_parches)
+                for start, end in ventanas]
+
+    pool = multiprocessing.Pool(processes=procesos, initializer=configurar_hilos_opencv, initargs=(hilos_opencv,))
+    try:
+        # Calentar los procesos (importaciones, apertura del video e índice de frames) antes de medir
+        pool.starmap(procesar_rango, tareas([(start, start + 1) for start, _ in ventanas[-procesos:]]), chunksize=1)
+
+        inicio = time.time()
+        pool.starmap(procesar_rango, tareas(ventanas), chunksize=1)
+        segundos = time.time() - inicio
+        frames = sum(end - start for start, end in ventanas)
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    return frames / segundos if segundos > 0 else 0.0
+
+
+def calibrar(video_path: str, modo: str, backend: str = 'opencv', escala: float = 1.0, hilos: int = 0, hilos_parches: int = 1):
+    """
+    Elige la cantidad de procesos, el tamaño de chunk y los hilos de OpenCV midiendo una muestra del video.
+
+    Cada candidato reparte los núcleos disponibles entre procesos, hilos de OpenCV e hilos de parches
+    (procesos × hilos de OpenCV × hilos de parches ≈ núcleos) y se queda con el de mayor rendimiento. El tamaño de chunk se elige para que cada chunk dure unos
+    segundos y cada proceso reciba varios chunks.
+
+    Args:
+        video_path (str): Ruta al archivo de video.
+        modo (str): Modo de procesamiento ('hibrido' o 'pyzbar').
+        backend (str): Backend de decodificación.
+        escala (float): Factor de escala aplicado durante la decodificación.
+        hilos (int): Hilos del decodificador.
+        hilos_parches (int): Hilos por proceso que decodifican los parches de cada frame (modo híbrido).
+
+    Returns:
+        dict: Configuración con 'procesos', 'tamano_chunk', 'hilos_opencv' y 'frames_por_segundo'.
+    """
+    # Los hilos de parches solo existen en el modo híbrido
+    hilos_parches = hilos_parches if modo == 'hibrido' else 1
+    nucleos = nucleos_disponibles()
+    total_frames = obtener_info_video(video_path)['total_frames']
+    print(f"Calibrando con {nucleos} núcleos disponibles...")
+
+    mejor = None
+    for hilos_opencv in HILOS_OPENCV_CANDIDATOS:
+        if hilos_opencv > 1 and hilos_opencv * hilos_parches > nucleos:
+            break
+        procesos = max(1, nucleos // (hilos_opencv * hilos_parches))
+        frames_por_segundo = medir_configuracion(video_path, modo, procesos, hilos_opencv, backend, escala, hilos, hilos_parches)
+        print(f"{procesos} procesos × {hilos_opencv} hilos de OpenCV × {hilos_parches} hilos de parches: {frames_por_segundo:.1f} frames/s")
+        if mejor is None or frames_por_segundo > mejor['frames_por_segundo']:
+            mejor = {'procesos': procesos, 'hilos_opencv': hilos_opencv, 'frames_por_segundo': frames_por_segundo}
+
+    frames_por_segundo_proceso = mejor['frames_por_segundo'] / mejor['procesos']
+    tamano_chunk = min(int(OBJETIVO_SEGUNDOS_CHUNK * frames_por_segundo_proceso),
+                       total_frames // (mejor['procesos'] * CHUNKS_POR_PROCESO))
+    mejor['tamano_chunk'] = max(MIN_FRAMES_CHUNK, tamano_chunk)
+    return mejor
+
+
+def cargar_configuraciones():
+    """
+    Lee las configuraciones persistidas.
+
+    Returns:
+        dict: Configuraciones indexadas por máquina y perfil de video.
+    """
+    try:
+        with open(ruta_cache()) as archivo:
+            return json.load(archivo)
+    except (OSError, ValueError):
+        return {}
+
+
+def guardar_configuracion(maquina: str, perfil: str, configuracion: dict):
+    """
+    Persiste la configuración calibrada para una máquina y un perfil de video.
+
+    Args:
+        maquina (str): Clave de la máquina.
+        perfil (str): Clave del perfil de video.
+        configuracion (dict): Configuración a guardar.
+    """
+    configuraciones = cargar_configuraciones()
+    configuraciones.setdefault(maquina, {})[perfil] = dict(configuracion, fecha=datetime.now().isoformat(timespec='seconds'))
+
+    ruta = ruta_cache()
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta + '.tmp', 'w') as archivo:
+        json.dump(configuraciones, archivo, indent=2)
+    os.replace(ruta + '.tmp', ruta)
+
+
+def obtener_configuracion(video_path: str, modo: str, backend: str = 'opencv', escala: float = 1.0, hilos: int = 0,
+                          recalibrar: bool = False, hilos_parches: int = 1):
+    """
+    Devuelve la configuración persistida para esta máquina y este perfil de video, calibrando si no existe.
+
+    Args:
+        video_path (str): Ruta al archivo de video.
+        modo (str): Modo de procesamiento ('hibrido' o 'pyzbar').
+        backend (str): Backend de decodificación.
+        escala (float): Factor de escala aplicado durante la decodificación.
+        hilos (int): Hilos del decodificador.
+        recalibrar (bool): Ignora la configuración persistida y vuelve a calibrar.
+        hilos_parches (int): Hilos por proceso que decodifican los parches de cada frame (modo híbrido). La cantidad
+            de procesos se calibra para que procesos × hilos de OpenCV × hilos de parches no exceda los núcleos.
+
+    Returns:
+        dict: Configuración con 'procesos', 'tamano_chunk', 'hilos_opencv' y 'frames_por_segundo'.
+    """
+    maquina = clave_maquina()
+    perfil = perfil_video(video_path, modo, backend, escala, hilos_parches)
+
+    configuracion = cargar_configuraciones().get(maquina, {}).get(perfil)
+    if configuracion is None or recalibrar:
+        configuracion = calibrar(video_path, modo, backend, escala, hilos, hilos_parches)
+        guardar_configuracion(maquina, perfil, configuracion)
+    else:
+        print(f"Usando la configuración calibrada para {perfil} en {maquina}.")
+
+    print(f"Autoajuste: {configuracion['procesos']} procesos, chunks de {configuracion['tamano_chunk']} frames, "
+          f"{configuracion['hilos_opencv']} hilos de OpenCV por proceso.")
+    return configuracion
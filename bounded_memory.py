@@ -0,0 +1,234 @@
+import os
+import json
+import shutil
+import resource
+import tempfile
+import multiprocessing
+from collections import deque
+from utils import mide_tiempo, dividir_en_rangos_alineados
+from progreso import MonitorProgreso, inicializar_proceso
+from video_decoding import obtener_info_video
+
+# Estimaciones usadas para repartir el presupuesto de memoria
+MB_BASE_PADRE = 300         # Intérprete, pandas y matplotlib en el proceso principal
+MB_BASE_PROCESO = 200       # Intérprete, OpenCV, numpy y zbar en cada proceso de trabajo
+COPIAS_FRAME = 4            # Buffer del decodificador, frame, recortes y codificación del PNG
+BYTES_POR_DETECCION = 1024  # Diccionario de una detección en memoria
+DETECCIONES_POR_FRAME = 20  # Cota pesimista de detecciones por frame
+MIN_FRAMES_CHUNK = 25
+MAX_FRAMES_CHUNK = 1000
+
+
+def leer_rss_mb():
+    """
+    Lee la memoria residente (RSS) actual del proceso.
+
+    Returns:
+        float: RSS en megabytes.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            paginas = int(statm.read().split()[1])
+        return paginas * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        # Sin /proc se usa el pico, que en Linux se informa en KB y en macOS en bytes
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def planificar_presupuesto(presupuesto_mb: float, ancho: int, alto: int, num_processes: int, escala: float = 1.0):
+    """
+    Reparte un presupuesto de memoria residente entre los procesos de trabajo.
+
+    Args:
+        presupuesto_mb (float): Memoria total disponible para la ejecución, en megabytes.
+        ancho (int): Ancho original del video.
+        alto (int): Alto original del video.
+        num_processes (int): Máximo de procesos pedido.
+        escala (float): Factor de escala aplicado durante la decodificación.
+
+    Returns:
+        dict: Diccionario con 'procesos', 'frames_por_chunk', 'profundidad_cola' y 'mb_por_proceso'.
+    """
+    mb_frame = ancho * escala * alto * escala * 3 * COPIAS_FRAME / 2**20
+    mb_por_frame_resultados = DETECCIONES_POR_FRAME * BYTES_POR_DETECCION / 2**20
+
+    disponible = presupuesto_mb - MB_BASE_PADRE
+    mb_minimo_proceso = MB_BASE_PROCESO + mb_frame + MIN_FRAMES_CHUNK * mb_por_frame_resultados
+    procesos = max(1, min(num_processes, int(disponible // mb_minimo_proceso)))
+    if disponible < mb_minimo_proceso:
+        print(f"Advertencia: el presupuesto de {presupuesto_mb:.0f} MB no alcanza para un proceso "
+              f"(se estiman {MB_BASE_PADRE + mb_minimo_proceso:.0f} MB). Se usará un único proceso.")
+
+    # Lo que sobra a cada proceso se destina a acumular resultados del chunk antes de volcarlos a disco
+    margen_proceso = max(0.0, disponible / procesos - MB_BASE_PROCESO - mb_frame)
+    frames_por_chunk = int(margen_proceso // mb_por_frame_resultados)
+    frames_por_chunk = max(MIN_FRAMES_CHUNK, min(MAX_FRAMES_CHUNK, frames_por_chunk))
+
+    # El proceso principal solo retiene rutas, pero cada chunk en vuelo ocupa memoria en los procesos;
+    # se permite una tanda extra de chunks encolados si el presupuesto sobrante la cubre
+    mb_chunk = frames_por_chunk * mb_por_frame_resultados
+    sobrante = disponible - procesos * (MB_BASE_PROCESO + mb_frame + mb_chunk)
+    extra = min(procesos, int(sobrante // mb_chunk)) if sobrante > 0 else 0
+    profundidad_cola = procesos + extra
+
+    return {
+        'procesos': procesos,
+        'frames_por_chunk': frames_por_chunk,
+        'profundidad_cola': profundidad_cola,
+        'mb_por_proceso': MB_BASE_PROCESO + mb_frame + mb_chunk
+    }
+
+
+class ResultadosEnDisco:
+    """
+    Resultados de detección volcados a disco en un archivo JSONL por chunk.
+
+    Iterar el objeto recorre las detecciones en orden de frame leyendo un chunk por vez, de modo que
+    puede consumirse varias veces (CSV, informes, video) sin cargar todo el video en memoria. Si `directorio`
+    es None los chunks pertenecen a otro (por ejemplo, a los shards) y `limpiar` no borra nada.
+    """
+
+    def __init__(self, directorio: str, rutas: list):
+        self.directorio = directorio
+        self.rutas = rutas
+
+    def __iter__(self):
+        for chunk in self.iterar_chunks():
+            yield from chunk
+
+    def iterar_chunks(self):
+        """
+        Recorre los chunks en orden de frame.
+
+        Yields:
+            list: Detecciones de un chunk.
+        """
+        for ruta in self.rutas:
+            with open(ruta) as archivo:
+                yield [json.loads(linea) for linea in archivo]
+
+    def limpiar(self):
+        """
+        Borra el directorio con los chunks volcados, si los resultados son dueños de él.
+        """
+        if self.directorio is not None:
+            shutil.rmtree(self.directorio, ignore_errors=True)
+
+
+def volcar_chunk(datos: list, ruta: str):
+    """
+    Escribe las detecciones de un chunk en un archivo JSONL de forma atómica.
+
+    Args:
+        datos (list): Lista de diccionarios con información sobre los códigos QR detectados.
+        ruta (str): Ruta del archivo de salida.
+    """
+    with open(ruta + '.tmp', 'w') as archivo:
+        for item in datos:
+            archivo.write(json.dumps(item) + '\n')
+    os.replace(ruta + '.tmp', ruta)
+
+
+def procesar_rango(modo: str, video_path: str, log_path: str, output_path: str, start_frame: int, end_frame: int,
+                   backend: str, escala: float, hilos: int, seleccion=None, hilos_parches: int = 1):
+    """
+    Procesa un rango de frames con el modo indicado en un proceso de trabajo.
+
+    Returns:
+        list: Lista de diccionarios con información sobre los códigos QR detectados.
+    """
+    # Importación diferida para no cargar ambos modos en cada proceso
+    if modo == 'hibrido':
+        import video_qr_processing_hybrid as hybrid_video_processing
+        return hybrid_video_processing.procesar_frame_range(video_path, log_path, start_frame, end_frame, output_path,
+                                                            backend=backend, escala=escala, hilos=hilos, seleccion=seleccion,
+                                                            hilos_parches=hilos_parches)
+    import video_qr_processing as pyzbar_video_processing
+    return pyzbar_video_processing.procesar_frame_range(video_path, log_path, start_frame, end_frame,
+                                                        backend=backend, escala=escala, hilos=hilos)
+
+
+def procesar_chunk(modo: str, video_path: str, log_path: str, output_path: str, start_frame: int, end_frame: int,
+                   directorio: str, backend: str, escala: float, hilos: int, seleccion=None, hilos_parches: int = 1):
+    """
+    Procesa un chunk de frames en un proceso de trabajo y vuelca sus resultados a disco.
+
+    Returns:
+        str: Ruta del archivo con las detecciones del chunk.
+    """
+    datos = procesar_rango(modo, video_path, log_path, output_path, start_frame, end_frame, backend, escala, hilos,
+                           seleccion, hilos_parches)
+
+    ruta = os.path.join(directorio, f'chunk_{start_frame:010d}.jsonl')
+    volcar_chunk(datos, ruta)
+    return ruta
+
+
+@mide_tiempo
+def procesar_video_acotado(video_path: str, log_path: str, output_path: str, presupuesto_mb: float, modo: str = 'hibrido',
+                           num_processes: int = 4, backend: str = 'opencv', escala: float = 1.0, hilos: int = 0,
+                           directorio_temporal: str = None, hilos_opencv: int = None, seleccion=None, hilos_parches: int = 1,
+                           progreso_jsonl: str = None):
+    """
+    Procesa un video con un presupuesto de memoria acotado.
+
+    El presupuesto determina la cantidad de procesos, el tamaño de los chunks y cuántos chunks pueden
+    estar en vuelo a la vez. Cada proceso vuelca las detecciones de su chunk a disco y el proceso principal
+    solo conserva las rutas, por lo que la memoria no crece con la duración del video.
+
+    Args:
+        video_path (str): Ruta al archivo de video.
+        log_path (str): Ruta al archivo de log para registrar errores.
+        output_path (str): Directorio de salida.
+        presupuesto_mb (float): Memoria residente total disponible, en megabytes.
+        modo (str): Modo de procesamiento ('hibrido' o 'pyzbar').
+        num_processes (int): Máximo de procesos a utilizar.
+        backend (str): Backend de decodificación ('opencv', 'pyav' o 'ffmpeg').
+        escala (float): Factor de escala aplicado durante la decodificación.
+        hilos (int): Hilos del decodificador en cada proceso (0 = automático).
+        directorio_temporal (str): Directorio donde crear los chunks (por defecto el temporal del sistema).
+        hilos_opencv (int): Hilos internos de OpenCV en cada proceso (None = valor por defecto de OpenCV).
+        seleccion (SeleccionParches): Máscaras de interés y mapa de calor del modo híbrido.
+        hilos_parches (int): Hilos por proceso que decodifican en paralelo los parches de cada frame (modo híbrido).
+        progreso_jsonl (str): Archivo al que se agregan los eventos de progreso en formato JSONL (opcional).
+
+    Returns:
+        ResultadosEnDisco: Resultados volcados a disco, iterables en orden de frame.
+    """
+    info = obtener_info_video(video_path)
+    plan = planificar_presupuesto(presupuesto_mb, info['ancho'], info['alto'], num_processes, escala)
+    # Cada chunk empieza en un keyframe para no decodificar frames que se descartan; al alinearlo un chunk puede
+    # crecer hasta el doble, así que se corta a la mitad del tamaño que permite el presupuesto
+    chunks = dividir_en_rangos_alineados(video_path, info['total_frames'], plan['procesos'],
+                                         max(1, plan['frames_por_chunk'] // 2))
+
+    print(f"Procesando video con {plan['procesos']} núcleos en {len(chunks)} chunks de hasta {plan['frames_por_chunk']} frames "
+          f"(presupuesto de {presupuesto_mb:.0f} MB, cola de {plan['profundidad_cola']} chunks)...")
+
+    directorio = tempfile.mkdtemp(prefix='qr_chunks_', dir=directorio_temporal)
+    rutas = []
+    pendientes = deque()
+
+    with MonitorProgreso(info['total_frames'], plan['procesos'], progreso_jsonl, etiqueta=video_path) as monitor:
+        pool = multiprocessing.Pool(processes=plan['procesos'], initializer=inicializar_proceso, initargs=monitor.initargs(hilos_opencv))
+        try:
+            for start, end in chunks:
+                pendientes.append(pool.apply_async(procesar_chunk, (modo, video_path, log_path, output_path, start, end,
+                                                                    directorio, backend, escala, hilos, seleccion,
+                                                                    hilos_parches)))
+                # No encolar más chunks que los que permite el presupuesto
+                if len(pendientes) >= plan['profundidad_cola']:
+                    rutas.append(pendientes.popleft().get())
+            while pendientes:
+                rutas.append(pendientes.popleft().get())
+        except BaseException:
+            pool.terminate()
+            shutil.rmtree(directorio, ignore_errors=True)
+            raise
+        pool.close()
+        pool.join()
+
+    pico_hijos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(f"RSS del proceso principal: {leer_rss_mb():.0f} MB, pico de un proceso de trabajo: {pico_hijos:.0f} MB")
+
+    return ResultadosEnDisco(directorio, rutas)
@@ -9,6 +9,7 @@ import warnings
 import multiprocessing
 import time
 import matplotlib.pyplot as plt
+from progreso import MonitorProgreso, inicializar_proceso, registrar
 
 warnings.filterwarnings("ignore")
 
@@ -21,7 +22,7 @@ def mide_tiempo(funcion):
     return funcion_medida
 
 
-def procesar_frame_range(video_path: str, log_path: str, start_frame: int, end_frame: int, progreso):
+def procesar_frame_range(video_path: str, log_path: str, start_frame: int, end_frame: int):
     """
     Procesa un rango de frames de un video para detectar códigos QR.
 
@@ -30,7 +31,6 @@ def procesar_frame_range(video_path: str, log_path: str, start_frame: int, end_f
         log_path (str): Ruta al archivo de log para registrar errores.
         start_frame (int): Frame inicial para comenzar el procesamiento.
         end_frame (int): Frame final hasta donde se debe procesar.
-        progreso (multiprocessing.Value): Valor compartido para el seguimiento del progreso.
 
     Returns:
         list: Lista de diccionarios con información sobre los códigos QR detectados.
@@ -75,15 +75,14 @@ def procesar_frame_range(video_path: str, log_path: str, start_frame: int, end_f
                     continue
 
             frame_num += 1
-            # Actualizar el progreso compartido solo cuando se completa un cuarto del total de frames
-            if (frame_num - start_frame) % ((end_frame - start_frame) // 4) == 0:
-                progreso.value += (end_frame - start_frame) // 4
+            # Actualizar los contadores de progreso en memoria compartida
+            registrar(1, 1, len(qrs))
 
     cap.release()
     return datos
 
 @mide_tiempo
-def procesar_video_parallel(video_path: str, log_path: str, num_processes: int = 4):
+def procesar_video_parallel(video_path: str, log_path: str, num_processes: int = 4, progreso_jsonl: str = None):
     """
     Procesa un video en paralelo utilizando múltiples procesos para detectar códigos QR.
 
@@ -91,6 +90,7 @@ def procesar_video_parallel(video_path: str, log_path: str, num_processes: int =
         video_path (str): Ruta al archivo de video.
         log_path (str): Ruta al archivo de log para registrar errores.
         num_processes (int): Número de procesos a utilizar para la ejecución paralela.
+        progreso_jsonl (str): Archivo al que se agregan los eventos de progreso en formato JSONL (opcional).
 
     Returns:
         list: Lista de diccionarios con información sobre los códigos QR detectados.
@@ -102,25 +102,17 @@ def procesar_video_parallel(video_path: str, log_path: str, num_processes: int =
     frame_ranges = [(i * (total_frames // num_processes), (i + 1) * (total_frames // num_processes)) for i in range(num_processes)]
     frame_ranges[-1] = (frame_ranges[-1][0], total_frames)  # Asegurarse de que el último proceso llegue hasta el final
 
-    # Crear un valor compartido para el progreso
-    with multiprocessing.Manager() as manager:
-        progreso = manager.Value('i', 0)
-        pool = multiprocessing.Pool(processes=num_processes)
-        results = pool.starmap_async(procesar_frame_range, [(video_path, log_path, start, end, progreso) for start, end in frame_ranges])
-
-        # Mostrar progreso en vivo
-        while not results.ready():
-            porcentaje = (progreso.value / total_frames) * 100
-            sys.stdout.write(f'\rProcesando: {porcentaje:.2f}%')
-            sys.stdout.flush()
-            time.sleep(0.5)
+    # Mostrar progreso en vivo a partir de contadores en memoria compartida
+    with MonitorProgreso(total_frames, num_processes, progreso_jsonl, intervalo=0.5, etiqueta=video_path) as monitor:
+        pool = multiprocessing.Pool(processes=num_processes, initializer=inicializar_proceso, initargs=monitor.initargs())
+        results = pool.starmap(procesar_frame_range, [(video_path, log_path, start, end) for start, end in frame_ranges])
 
         # Esperar a que todos los procesos terminen
         pool.close()
         pool.join()
 
-        # Unir los resultados de todos los procesos
-        datos = [item for sublist in results.get() for item in sublist]
+    # Unir los resultados de todos los procesos
+    datos = [item for sublist in results for item in sublist]
     return datos
 
 def generar_csv(datos, salida_csv: str):
@@ -214,7 +206,8 @@ def generar_informe_detallado(datos):
 @click.option('--salida-csv', required=True, type=str, help='Ruta al archivo CSV de salida')
 @click.option('--log-path', required=True, type=str, help='Ruta al archivo de log para errores')
 @click.option('--num-processes', required=False, type=int, default=4, help='Número de procesos para la ejecución paralela')
-def main(video_path: str, salida_csv: str, log_path: str, num_processes: int):
+@click.option('--progreso-jsonl', type=str, default=None, help='Archivo al que se agregan los eventos de progreso en formato JSONL')
+def main(video_path: str, salida_csv: str, log_path: str, num_processes: int, progreso_jsonl: str):
     """
     Función principal que coordina la ejecución del procesamiento del video, la generación del CSV y el informe.
 
@@ -223,8 +216,9 @@ def main(video_path: str, salida_csv: str, log_path: str, num_processes: int):
         salida_csv (str): Ruta del archivo CSV de salida.
         log_path (str): Ruta al archivo de log para registrar errores.
         num_processes (int): Número de procesos a utilizar para la ejecución paralela.
+        progreso_jsonl (str): Archivo al que se agregan los eventos de progreso en formato JSONL.
     """
-    datos = procesar_video_parallel(video_path, log_path, num_processes)
+    datos = procesar_video_parallel(video_path, log_path, num_processes, progreso_jsonl)
     generar_csv(datos, salida_csv)
     generar_informe(datos)
     generar_grafico_temporal(datos)
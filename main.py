@@ -2,7 +2,12 @@ import os
 import click
 import video_qr_processing as pyzbar_video_processing
 import video_qr_processing_hybrid as hybrid_video_processing
-from utils import generar_csv, generar_video_con_qr
+from utils import generar_csv, generar_csv_por_chunks, generar_video_con_qr
+from bounded_memory import procesar_video_acotado, ResultadosEnDisco
+from autotuning import obtener_configuracion
+from roi import MODOS_MAPA_CALOR, SeleccionParches, cargar_poligonos, cargar_mapa_calor, actualizar_mapa_calor
+from video_decoding import BACKENDS
+from payload_index import ingestar_resultados
 from reporting import generar_informe, generar_grafico_distribucion, generar_grafico_temporal
 
 
@@ -17,19 +22,90 @@ from reporting import generar_informe, generar_grafico_distribucion, generar_gra
 @click.option('--factor-lentitud', type=float, default=0.5, help='Factor para ralentizar el video (menor a 1 lo hará más lento, mayor a 1 lo hará más rápido)')
 @click.option('--modo', type=click.Choice(['pyzbar', 'hibrido'], case_sensitive=False), default='hibrido', help='Modo de procesamiento: pyzbar o híbrido')
 @click.option('--prefijo', type=str, default="", help='Prefijo para los nombres de los frames del video en el csv')
-def main(output_path:str, video_path: str, salida_csv: str, log_path: str, num_processes: int, generar_video: bool, output_video: str, factor_lentitud: float, modo: str, prefijo: str):
+@click.option('--backend', type=click.Choice(BACKENDS, case_sensitive=False), default='opencv', help='Backend de decodificación del video: opencv, pyav o ffmpeg')
+@click.option('--escala-decodificacion', type=float, default=1.0, help='Factor de escala aplicado por el decodificador antes de la detección (1.0 = resolución original)')
+@click.option('--hilos-decodificacion', type=int, default=0, help='Hilos del decodificador en cada proceso (0 = automático, no aplica a opencv)')
+@click.option('--presupuesto-memoria-mb', type=float, default=0, help='Memoria residente máxima en MB; si se indica, los resultados se vuelcan a disco por chunks (0 = sin límite)')
+@click.option('--autoajuste', is_flag=True, help='Calibra (o reutiliza la calibración persistida) la cantidad de procesos, el tamaño de chunk y los hilos de OpenCV')
+@click.option('--recalibrar', is_flag=True, help='Con --autoajuste, ignora la calibración persistida y vuelve a calibrar')
+@click.option('--roi-config', type=str, default=None, help='Archivo JSON con los polígonos de interés por cámara y por video (modo híbrido)')
+@click.option('--camara', type=str, default=None, help='Cámara del archivo --roi-config a usar; tiene prioridad sobre la configuración del video en el archivo')
+@click.option('--mapa-calor', type=str, default=None, help='Mapa de calor de detecciones anteriores; se actualiza con los resultados de esta ejecución (modo híbrido)')
+@click.option('--modo-mapa-calor', type=click.Choice(MODOS_MAPA_CALOR, case_sensitive=False), default='priorizar', help='priorizar: los tiles fríos se revisan por turnos; restringir: solo en auditorías')
+@click.option('--periodo-auditoria', type=int, default=50, help='Cada cuántos frames se revisan completos los tiles fríos')
+@click.option('--hilos-por-proceso', type=int, default=1, help='Hilos por proceso que decodifican en paralelo los parches de cada frame (modo híbrido)')
+@click.option('--indice', type=str, default=None, help='Índice de payloads (SQLite) al que se agregan los resultados de esta ejecución')
+@click.option('--progreso-jsonl', type=str, default=None, help='Archivo al que se agregan los eventos de progreso en formato JSONL (para orquestadores)')
+def main(output_path:str, video_path: str, salida_csv: str, log_path: str, num_processes: int, generar_video: bool, output_video: str, factor_lentitud: float, modo: str, prefijo: str,
+         backend: str, escala_decodificacion: float, hilos_decodificacion: int, presupuesto_memoria_mb: float, autoajuste: bool, recalibrar: bool,
+         roi_config: str, camara: str, mapa_calor: str, modo_mapa_calor: str, periodo_auditoria: int, hilos_por_proceso: int,
+         indice: str, progreso_jsonl: str):
 
     os.makedirs(output_path, exist_ok=True)
 
+    seleccion = None
+    if roi_config or mapa_calor:
+        poligonos = cargar_poligonos(roi_config, video_path, camara) if roi_config else None
+        seleccion = SeleccionParches(poligonos, cargar_mapa_calor(mapa_calor) if mapa_calor else None,
+                                     modo_mapa_calor, periodo_auditoria)
+
+    tamano_chunk, hilos_opencv = None, None
+    if autoajuste:
+        configuracion = obtener_configuracion(video_path, modo, backend, escala_decodificacion, hilos_decodificacion, recalibrar,
+                                              hilos_por_proceso)
+        num_processes = configuracion['procesos']
+        tamano_chunk = configuracion['tamano_chunk']
+        hilos_opencv = configuracion['hilos_opencv']
+
     # Procesar el video y generar CSV
-    if modo == 'hibrido':
-        datos = hybrid_video_processing.procesar_video_parallel(video_path, output_path+log_path, output_path, num_processes)
+    if presupuesto_memoria_mb > 0:
+        datos = procesar_video_acotado(video_path, output_path+log_path, output_path, presupuesto_memoria_mb, modo, num_processes,
+                                       backend=backend, escala=escala_decodificacion, hilos=hilos_decodificacion, hilos_opencv=hilos_opencv,
+                                       seleccion=seleccion, hilos_parches=hilos_por_proceso, progreso_jsonl=progreso_jsonl)
+    elif modo == 'hibrido':
+        datos = hybrid_video_processing.procesar_video_parallel(video_path, output_path+log_path, output_path, num_processes,
+                                                                backend=backend, escala=escala_decodificacion, hilos=hilos_decodificacion,
+                                                                tamano_chunk=tamano_chunk, hilos_opencv=hilos_opencv, seleccion=seleccion,
+                                                                hilos_parches=hilos_por_proceso, progreso_jsonl=progreso_jsonl)
     elif modo == 'pyzbar':
-        datos = pyzbar_video_processing.procesar_video_pyzbar(video_path, output_path+log_path, num_processes)
+        datos = pyzbar_video_processing.procesar_video_parallel(video_path, output_path+log_path, num_processes,
+                                                                backend=backend, escala=escala_decodificacion, hilos=hilos_decodificacion,
+                                                                tamano_chunk=tamano_chunk, hilos_opencv=hilos_opencv,
+                                                                progreso_jsonl=progreso_jsonl)
     else:
         raise ValueError("Modo de procesamiento no válido. Use 'pyzbar' o 'hibrido'.")
 
-    generar_csv(datos, prefijo, f"{output_path}/{salida_csv}")
+    generar_salidas(datos, video_path, output_path, salida_csv, prefijo, generar_video, output_video, factor_lentitud)
+
+    if mapa_calor:
+        actualizar_mapa_calor(mapa_calor, datos)
+
+    if indice:
+        ingestar_resultados(indice, video_path, datos)
+
+    if isinstance(datos, ResultadosEnDisco):
+        datos.limpiar()
+
+
+def generar_salidas(datos, video_path: str, output_path: str, salida_csv: str, prefijo: str, generar_video: bool = False,
+                    output_video: str = "output_video.mp4", factor_lentitud: float = 0.5):
+    """
+    Genera el CSV, el informe, los gráficos y opcionalmente el video a partir de las detecciones.
+
+    Args:
+        datos (list | ResultadosEnDisco): Detecciones en memoria o volcadas a disco, ordenadas por frame.
+        video_path (str): Ruta al archivo de video original.
+        output_path (str): Directorio de salida.
+        salida_csv (str): Nombre del archivo CSV dentro del directorio de salida.
+        prefijo (str): Prefijo para los nombres de los frames en el CSV.
+        generar_video (bool): Indica si se debe generar el video con los recuadros de los QR detectados.
+        output_video (str): Nombre del video de salida dentro del directorio de salida.
+        factor_lentitud (float): Factor para ralentizar el video de salida.
+    """
+    if isinstance(datos, ResultadosEnDisco):
+        generar_csv_por_chunks(datos.iterar_chunks(), prefijo, f"{output_path}/{salida_csv}")
+    else:
+        generar_csv(datos, prefijo, f"{output_path}/{salida_csv}")
 
     # Generar informe y gráficos
     generar_informe(datos)
@@ -0,0 +1,310 @@
+import os
+import sqlite3
+from contextlib import closing
+from collections import defaultdict
+from datetime import datetime
+import click
+from utils import leer_csv_detecciones
+
+TOLERANCIA_FRAMES = 5  # Frames sin detección tolerados dentro de un mismo intervalo
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    id INTEGER PRIMARY KEY,
+    clave TEXT UNIQUE NOT NULL,
+    fps REAL,
+    firma TEXT,
+    indexado TEXT
+);
+CREATE TABLE IF NOT EXISTS intervalos (
+    payload TEXT NOT NULL,
+    video_id INTEGER NOT NULL REFERENCES videos(id),
+    frame_inicio INTEGER NOT NULL,
+    frame_fin INTEGER NOT NULL,
+    detecciones INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_intervalos_payload ON intervalos(payload);
+CREATE INDEX IF NOT EXISTS idx_intervalos_video ON intervalos(video_id);
+CREATE TABLE IF NOT EXISTS quads (
+    payload TEXT NOT NULL,
+    video_id INTEGER NOT NULL REFERENCES videos(id),
+    frame INTEGER NOT NULL,
+    x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER, x3 INTEGER, y3 INTEGER, x4 INTEGER, y4 INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_quads_payload ON quads(payload, video_id, frame);
+CREATE INDEX IF NOT EXISTS idx_quads_video ON quads(video_id);
+"""
+
+
+def abrir_indice(ruta_indice: str):
+    """
+    Abre (y crea si no existe) el índice de payloads.
+
+    Args:
+        ruta_indice (str): Ruta al archivo SQLite del índice.
+
+    Returns:
+        sqlite3.Connection: Conexión al índice.
+    """
+    directorio = os.path.dirname(ruta_indice)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    conexion = sqlite3.connect(ruta_indice)
+    # WAL permite consultar mientras otro proceso ingesta
+    conexion.execute('PRAGMA journal_mode=WAL')
+    conexion.executescript(_ESQUEMA)
+    return conexion
+
+
+def firma_archivo(ruta: str):
+    """
+    Resume tamaño y fecha de modificación de un archivo para detectar si cambió desde la última ingesta.
+    """
+    estado = os.stat(ruta)
+    return f'{estado.st_size}-{estado.st_mtime_ns}'
+
+
+def normalizar_payload(data):
+    """
+    Normaliza un payload igual que el CSV de salida, que lo guarda como entero (por ejemplo '0123' como 123),
+    para que las detecciones ingestadas desde memoria y desde un CSV, y las consultas, usen la misma clave.
+
+    Args:
+        data: Contenido del QR.
+
+    Returns:
+        str: Payload normalizado.
+    """
+    try:
+        return str(int(data))
+    except (TypeError, ValueError):
+        return str(data)
+
+
+def agrupar_intervalos(frames: list, tolerancia: int = TOLERANCIA_FRAMES):
+    """
+    Agrupa frames en intervalos, uniendo detecciones separadas por a lo sumo `tolerancia` frames sin detección.
+
+    Args:
+        frames (list): Números de frame (pueden repetirse y no estar ordenados).
+        tolerancia (int): Frames sin detección tolerados dentro de un intervalo.
+
+    Returns:
+        list: Lista de tuplas (frame inicial, frame final, cantidad de detecciones).
+    """
+    intervalos = []
+    for frame in sorted(frames):
+        if intervalos and frame - intervalos[-1][1] <= tolerancia + 1:
+            inicio, _, detecciones = intervalos[-1]
+            intervalos[-1] = (inicio, frame, detecciones + 1)
+        else:
+            intervalos.append((frame, frame, 1))
+    return intervalos
+
+
+def ingestar(ruta_indice: str, clave: str, datos, fps: float = None, firma: str = None,
+             guardar_quads: bool = True, tolerancia: int = TOLERANCIA_FRAMES):
+    """
+    Agrega al índice las detecciones de un video, reemplazando las que hubiera de ese mismo video.
+
+    Args:
+        ruta_indice (str): Ruta al archivo SQLite del índice.
+        clave (str): Identificador del video en el índice (normalmente su ruta absoluta).
+        datos (iterable): Diccionarios con información sobre los códigos QR detectados.
+        fps (float): Frames por segundo del video, para responder en tiempos además de frames.
+        firma (str): Firma de la fuente. Si coincide con la indexada, el video no se vuelve a ingestar.
+        guardar_quads (bool): Guarda también las cuatro esquinas de cada detección.
+        tolerancia (int): Frames sin detección tolerados dentro de un intervalo.
+
+    Returns:
+        bool: True si se ingestó, False si la fuente no cambió desde la última ingesta.
+    """
+    with closing(abrir_indice(ruta_indice)) as conexion, conexion:
+        fila = conexion.execute('SELECT id, firma FROM videos WHERE clave = ?', (clave,)).fetchone()
+        if fila is not None and firma is not None and fila[1] == firma:
+            return False
+
+        if fila is not None:
+            video_id = fila[0]
+            conexion.execute('DELETE FROM intervalos WHERE video_id = ?', (video_id,))
+            conexion.execute('DELETE FROM quads WHERE video_id = ?', (video_id,))
+            conexion.execute('UPDATE videos SET fps = ?, firma = ?, indexado = ? WHERE id = ?',
+                             (fps, firma, datetime.now().isoformat(timespec='seconds'), video_id))
+        else:
+            video_id = conexion.execute('INSERT INTO videos (clave, fps, firma, indexado) VALUES (?, ?, ?, ?)',
+                                        (clave, fps, firma, datetime.now().isoformat(timespec='seconds'))).lastrowid
+
+        frames_por_payload = defaultdict(list)
+        quads = []
+        for item in datos:
+            payload = normalizar_payload(item['data'])
+            frames_por_payload[payload].append(item['frame'])
+            if guardar_quads:
+                quads.append((payload, video_id, item['frame'],
+                               *(item[f'{eje}{i}'] for i in range(1, 5) for eje in ('x', 'y'))))
+                # Insertar por tandas para no acumular todas las esquinas en memoria
+                if len(quads) >= 10000:
+                    conexion.executemany('INSERT INTO quads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', quads)
+                    quads = []
+        if quads:
+            conexion.executemany('INSERT INTO quads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', quads)
+
+        conexion.executemany('INSERT INTO intervalos VALUES (?, ?, ?, ?, ?)',
+                             ((payload, video_id, inicio, fin, detecciones)
+                              for payload, frames in frames_por_payload.items()
+                              for inicio, fin, detecciones in agrupar_intervalos(frames, tolerancia)))
+    return True
+
+
+def ingestar_resultados(ruta_indice: str, video_path: str, datos, **kwargs):
+    """
+    Agrega al índice los resultados de `procesar_video_parallel` (o de `procesar_video_acotado`) de un video,
+    reemplazando los de ejecuciones anteriores sobre ese mismo video.
+
+    Args:
+        ruta_indice (str): Ruta al archivo SQLite del índice.
+        video_path (str): Ruta al archivo de video procesado.
+        datos (iterable): Diccionarios con información sobre los códigos QR detectados.
+    """
+    from video_decoding import obtener_info_video
+    ingestar(ruta_indice, os.path.abspath(video_path), datos, obtener_info_video(video_path)['fps'], **kwargs)
+
+
+def ingestar_csv(ruta_indice: str, ruta_csv: str, video_path: str, fps: float = None, **kwargs):
+    """
+    Agrega al índice las detecciones de un CSV generado por `generar_csv`. Si el CSV no cambió desde la
+    última ingesta no se vuelve a leer.
+
+    El video se identifica por su ruta, igual que en `ingestar_resultados`, para que ingestar el CSV de un
+    video ya indexado reemplace sus resultados en lugar de agregarlo por segunda vez.
+
+    Args:
+        ruta_indice (str): Ruta al archivo SQLite del índice.
+        ruta_csv (str): Ruta al CSV.
+        video_path (str): Video al que corresponde el CSV (no hace falta que exista si se indican los fps).
+        fps (float): Frames por segundo del video. Si se omite y el video existe, se leen del video.
+
+    Returns:
+        bool: True si se ingestó, False si el CSV no cambió desde la última ingesta.
+    """
+    if fps is None and os.path.exists(video_path):
+        from video_decoding import obtener_info_video
+        fps = obtener_info_video(video_path)['fps']
+    return ingestar(ruta_indice, os.path.abspath(video_path), leer_csv_detecciones(ruta_csv), fps,
+                    firma_archivo(ruta_csv), **kwargs)
+
+
+def consultar(ruta_indice: str, payload: str):
+    """
+    Busca en qué videos y en qué intervalos apareció un payload.
+
+    Args:
+        ruta_indice (str): Ruta al archivo SQLite del índice.
+        payload (str): Contenido del QR.
+
+    Returns:
+        list: Diccionarios con 'video', 'frame_inicio', 'frame_fin', 'segundo_inicio', 'segundo_fin' y 'detecciones'.
+    """
+    with closing(abrir_indice(ruta_indice)) as conexion:
+        filas = conexion.execute(
+            'SELECT v.clave, v.fps, i.frame_inicio, i.frame_fin, i.detecciones '
+            'FROM intervalos i JOIN videos v ON v.id = i.video_id '
+            'WHERE i.payload = ? ORDER BY v.clave, i.frame_inicio', (normalizar_payload(payload),)).fetchall()
+
+    return [{
+        'video': clave,
+        'frame_inicio': inicio,
+        'frame_fin': fin,
+        'segundo_inicio': inicio / fps if fps else None,
+        'segundo_fin': fin / fps if fps else None,
+        'detecciones': detecciones
+    } for clave, fps, inicio, fin, detecciones in filas]
+
+
+def consultar_quads(ruta_indice: str, payload: str, video: str = None, frame_inicio: int = None, frame_fin: int = None):
+    """
+    Devuelve las esquinas de cada detección de un payload, opcionalmente limitadas a un video y un rango de frames.
+
+    Args:
+        ruta_indice (str): Ruta al archivo SQLite del índice.
+        payload (str): Contenido del QR.
+        video (str): Clave del video.
+        frame_inicio (int): Primer frame del rango.
+        frame_fin (int): Último frame del rango (incluido).
+
+    Returns:
+        list: Diccionarios con 'video', 'frame', 'data' y 'x1'..'y4'.
+    """
+    condiciones, parametros = ['q.payload = ?'], [normalizar_payload(payload)]
+    if video is not None:
+        condiciones.append('v.clave = ?')
+        parametros.append(video)
+    if frame_inicio is not None:
+        condiciones.append('q.frame >= ?')
+        parametros.append(frame_inicio)
+    if frame_fin is not None:
+        condiciones.append('q.frame <= ?')
+        parametros.append(frame_fin)
+
+    with closing(abrir_indice(ruta_indice)) as conexion:
+        filas = conexion.execute(
+            'SELECT v.clave, q.frame, q.payload, q.x1, q.y1, q.x2, q.y2, q.x3, q.y3, q.x4, q.y4 '
+            'FROM quads q JOIN videos v ON v.id = q.video_id '
+            f'WHERE {" AND ".join(condiciones)} ORDER BY v.clave, q.frame', parametros).fetchall()
+
+    columnas = ['video', 'frame', 'data', 'x1', 'y1', 'x2', 'y2', 'x3', 'y3', 'x4', 'y4']
+    return [dict(zip(columnas, fila)) for fila in filas]
+
+
+@click.group()
+def cli():
+    """
+    Índice de payloads: en qué videos y en qué momentos apareció cada QR.
+    """
+
+
+@cli.command('ingest-csv')
+@click.option('--indice', required=True, type=str, help='Ruta al archivo del índice')
+@click.option('--csv', 'csvs', required=True, multiple=True, type=str, help='CSV generado por main.py (puede repetirse)')
+@click.option('--video-path', 'videos', required=True, multiple=True, type=str, help='Video al que corresponde cada --csv, en el mismo orden')
+@click.option('--fps', type=float, default=None, help='Frames por segundo del video, si no puede leerse del video')
+@click.option('--sin-quads', is_flag=True, help='No guardar las esquinas de cada detección, solo los intervalos')
+def ingest_csv(indice: str, csvs: tuple, videos: tuple, fps: float, sin_quads: bool):
+    """
+    Agrega CSV de ejecuciones anteriores al índice. Los CSV que no cambiaron desde la última ingesta se omiten.
+    """
+    if len(videos) != len(csvs):
+        raise click.UsageError('Debe indicarse un --video-path por cada --csv.')
+    for ruta_csv, video_path in zip(csvs, videos):
+        if ingestar_csv(indice, ruta_csv, video_path, fps, guardar_quads=not sin_quads):
+            print(f"Ingestado: {ruta_csv}")
+        else:
+            print(f"Sin cambios: {ruta_csv}")
+
+
+@cli.command()
+@click.option('--indice', required=True, type=str, help='Ruta al archivo del índice')
+@click.option('--payload', required=True, type=str, help='Contenido del QR a buscar')
+@click.option('--quads', is_flag=True, help='Mostrar también las esquinas de cada detección')
+def query(indice: str, payload: str, quads: bool):
+    """
+    Muestra en qué videos y en qué momentos apareció un QR.
+    """
+    intervalos = consultar(indice, payload)
+    if not intervalos:
+        print(f"El QR {payload} no aparece en el índice.")
+    for intervalo in intervalos:
+        tiempo = ''
+        if intervalo['segundo_inicio'] is not None:
+            tiempo = f" ({intervalo['segundo_inicio']:.2f}s a {intervalo['segundo_fin']:.2f}s)"
+        print(f"{intervalo['video']}: frames {intervalo['frame_inicio']} a {intervalo['frame_fin']}{tiempo}, "
+              f"{intervalo['detecciones']} detecciones")
+
+    if quads:
+        for item in consultar_quads(indice, payload):
+            esquinas = ', '.join(f"({item[f'x{i}']}, {item[f'y{i}']})" for i in range(1, 5))
+            print(f"{item['video']} frame {item['frame']}: {esquinas}")
+
+
+if __name__ == "__main__":
+    cli()
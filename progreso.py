@@ -0,0 +1,163 @@
+import sys
+import json
+import time
+import threading
+import multiprocessing
+from datetime import timedelta
+from utils import configurar_hilos_opencv
+
+CONTADORES = ('frames', 'parches', 'detecciones')
+
+# Contadores del proceso de trabajo actual (ver inicializar_proceso)
+_contadores = None
+_base = 0
+
+
+def inicializar_proceso(hilos_opencv: int = None, contadores=None, siguiente_slot=None):
+    """
+    Inicializador de los procesos de trabajo: configura los hilos de OpenCV y reserva para el proceso
+    una fila propia de los contadores de progreso compartidos.
+
+    Args:
+        hilos_opencv (int): Hilos internos de OpenCV (None = valor por defecto de OpenCV).
+        contadores (multiprocessing.RawArray): Contadores compartidos creados por `MonitorProgreso`.
+        siguiente_slot (multiprocessing.Value): Próxima fila libre de los contadores.
+    """
+    global _contadores, _base
+    configurar_hilos_opencv(hilos_opencv)
+    if contadores is None:
+        return
+    with siguiente_slot.get_lock():
+        slot = siguiente_slot.value
+        siguiente_slot.value += 1
+    _base = (slot % (len(contadores) // len(CONTADORES))) * len(CONTADORES)
+    _contadores = contadores
+
+
+def registrar(frames: int = 1, parches: int = 0, detecciones: int = 0):
+    """
+    Suma el trabajo hecho a los contadores del proceso actual. Cada proceso escribe solo su propia fila
+    de memoria compartida, sin locks ni IPC; fuera de un proceso con contadores no hace nada.
+
+    Args:
+        frames (int): Frames decodificados.
+        parches (int): Parches (o frames completos) escaneados.
+        detecciones (int): Códigos QR detectados.
+    """
+    if _contadores is None:
+        return
+    _contadores[_base] += frames
+    _contadores[_base + 1] += parches
+    _contadores[_base + 2] += detecciones
+
+
+class MonitorProgreso:
+    """
+    Muestra el progreso de un procesamiento paralelo leyendo periódicamente los contadores compartidos
+    de los procesos de trabajo, y opcionalmente lo escribe como eventos JSONL.
+
+    Los contadores se pasan a los procesos a través del inicializador del pool:
+
+        with MonitorProgreso(total_frames, num_processes, ruta_jsonl) as monitor:
+            pool = multiprocessing.Pool(num_processes, initializer=inicializar_proceso, initargs=monitor.initargs(hilos_opencv))
+
+    Cada evento JSONL es un objeto con 'evento' ('inicio', 'progreso', 'fin' o 'error'), 'etiqueta', 'timestamp',
+    'transcurrido', 'frames', 'total_frames', 'porcentaje', 'parches', 'detecciones', 'fps', 'fps_medio',
+    'eta_segundos' y 'procesos' (los contadores de cada proceso).
+    """
+
+    def __init__(self, total_frames: int, num_procesos: int, ruta_jsonl: str = None, intervalo: float = 1.0,
+                 etiqueta: str = None, mostrar: bool = True):
+        self.total_frames = total_frames
+        self.ruta_jsonl = ruta_jsonl
+        self.intervalo = intervalo
+        self.etiqueta = etiqueta
+        self.mostrar = mostrar
+        self.contadores = multiprocessing.RawArray('q', max(1, num_procesos) * len(CONTADORES))
+        self.siguiente_slot = multiprocessing.Value('i', 0)
+
+        self._detener = threading.Event()
+        self._hilo = None
+        self._archivo = None
+        self._inicio = None
+        self._ultimo = None
+
+    def initargs(self, hilos_opencv: int = None):
+        """
+        Argumentos para `inicializar_proceso` como inicializador del pool.
+        """
+        return (hilos_opencv, self.contadores, self.siguiente_slot)
+
+    def leer(self):
+        """
+        Lee los contadores de todos los procesos.
+
+        Returns:
+            list: Un diccionario por proceso con 'frames', 'parches' y 'detecciones'.
+        """
+        valores = self.contadores[:]
+        n = len(CONTADORES)
+        return [dict(zip(CONTADORES, valores[i:i + n])) for i in range(0, len(valores), n)]
+
+    def _evento(self, tipo: str):
+        ahora = time.time()
+        procesos = self.leer()
+        totales = {contador: sum(p[contador] for p in procesos) for contador in CONTADORES}
+        transcurrido = ahora - self._inicio
+
+        # Velocidad desde el evento anterior y velocidad media, que es la que se usa para la ETA
+        tiempo_anterior, frames_anteriores = self._ultimo
+        fps = (totales['frames'] - frames_anteriores) / (ahora - tiempo_anterior) if ahora > tiempo_anterior else 0.0
+        fps_medio = totales['frames'] / transcurrido if transcurrido > 0 else 0.0
+        self._ultimo = (ahora, totales['frames'])
+
+        restantes = max(0, self.total_frames - totales['frames'])
+        return {
+            'evento': tipo,
+            'etiqueta': self.etiqueta,
+            'timestamp': ahora,
+            'transcurrido': transcurrido,
+            **totales,
+            'total_frames': self.total_frames,
+            'porcentaje': 100.0 * totales['frames'] / self.total_frames if self.total_frames else 100.0,
+            'fps': fps,
+            'fps_medio': fps_medio,
+            'eta_segundos': restantes / fps_medio if fps_medio > 0 else None,
+            'procesos': procesos
+        }
+
+    def _emitir(self, tipo: str):
+        evento = self._evento(tipo)
+        if self._archivo:
+            self._archivo.write(json.dumps(evento) + '\n')
+            self._archivo.flush()
+        if self.mostrar:
+            eta = '--' if evento['eta_segundos'] is None else str(timedelta(seconds=int(evento['eta_segundos'])))
+            sys.stdout.write(f"\rProcesando: {evento['porcentaje']:.2f}% | {evento['frames']}/{self.total_frames} frames | "
+                             f"{evento['fps_medio']:.1f} frames/s | {evento['detecciones']} detecciones | ETA {eta}   ")
+            sys.stdout.flush()
+
+    def _ejecutar(self):
+        while not self._detener.wait(self.intervalo):
+            self._emitir('progreso')
+
+    def __enter__(self):
+        if self.ruta_jsonl:
+            self._archivo = open(self.ruta_jsonl, 'a')
+        self._inicio = time.time()
+        self._ultimo = (self._inicio, 0)
+        self._emitir('inicio')
+        self._hilo = threading.Thread(target=self._ejecutar, daemon=True)
+        self._hilo.start()
+        return self
+
+    def __exit__(self, tipo_excepcion, excepcion, traza):
+        self._detener.set()
+        self._hilo.join()
+        self._emitir('fin' if tipo_excepcion is None else 'error')
+        if self.mostrar:
+            sys.stdout.write('\n')
+            sys.stdout.flush()
+        if self._archivo:
+            self._archivo.close()
+        return False
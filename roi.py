@@ -0,0 +1,217 @@
+import os
+import cv2
+import json
+import numpy as np
+import click
+from utils import leer_csv_detecciones
+
+MODOS_MAPA_CALOR = ('priorizar', 'restringir')
+
+
+def grilla_parches(ancho: int, alto: int, tamano_parche: int):
+    """
+    Devuelve los orígenes de todos los parches en que se divide un frame.
+
+    Args:
+        ancho (int): Ancho del frame.
+        alto (int): Alto del frame.
+        tamano_parche (int): Lado del parche en píxeles.
+
+    Returns:
+        list: Lista de tuplas (x, y) con la esquina superior izquierda de cada parche.
+    """
+    return [(x, y) for y in range(0, alto, tamano_parche) for x in range(0, ancho, tamano_parche)]
+
+
+def cargar_poligonos(config_path: str, video_path: str, camara: str = None):
+    """
+    Obtiene los polígonos de interés de un video a partir del archivo de configuración.
+
+    El archivo es un JSON con polígonos por cámara y por video, en píxeles de la resolución original:
+
+        {
+            "camaras": {"cam01": {"poligonos": [[[x, y], [x, y], [x, y], ...]]}},
+            "videos": {"video.mp4": {"camara": "cam01"}, "otro.mp4": {"poligonos": [...]}}
+        }
+
+    Una cámara indicada explícitamente con `camara` tiene prioridad sobre lo que diga el archivo para el video.
+    Si no se indica, un video con polígonos propios los usa y si no, usa los de la cámara que le asigna el archivo.
+
+    Args:
+        config_path (str): Ruta al archivo de configuración.
+        video_path (str): Ruta al archivo de video.
+        camara (str): Cámara a usar, con prioridad sobre la configuración del video en el archivo.
+
+    Returns:
+        list: Lista de polígonos, cada uno una lista de puntos (x, y). None si no hay restricción.
+    """
+    with open(config_path) as archivo:
+        config = json.load(archivo)
+
+    video = config.get('videos', {}).get(os.path.basename(video_path), {})
+    if camara is None:
+        if 'poligonos' in video:
+            return video['poligonos']
+        camara = video.get('camara')
+    if camara is None:
+        return None
+    if camara not in config.get('camaras', {}):
+        raise ValueError(f"La cámara '{camara}' no está definida en {config_path}.")
+    return config['camaras'][camara]['poligonos']
+
+
+def construir_mapa_calor(datos, tamano_parche: int = 300, mapa: dict = None):
+    """
+    Acumula las detecciones en un mapa de calor por tile.
+
+    Args:
+        datos (iterable): Diccionarios con información sobre los códigos QR detectados.
+        tamano_parche (int): Lado de los tiles del mapa en píxeles de la resolución original.
+        mapa (dict): Mapa existente a actualizar. Si es None se crea uno nuevo.
+
+    Returns:
+        dict: Mapa con 'tamano_parche' y 'conteos' (detecciones por tile 'columna,fila').
+    """
+    if mapa is None:
+        mapa = {'tamano_parche': tamano_parche, 'conteos': {}}
+    tamano = mapa['tamano_parche']
+    conteos = mapa['conteos']
+
+    for item in datos:
+        xs = [item[f'x{i}'] for i in range(1, 5)]
+        ys = [item[f'y{i}'] for i in range(1, 5)]
+        # Todos los tiles que toca el rectángulo que contiene al QR
+        for fila in range(max(0, min(ys)) // tamano, max(0, max(ys)) // tamano + 1):
+            for columna in range(max(0, min(xs)) // tamano, max(0, max(xs)) // tamano + 1):
+                clave = f'{columna},{fila}'
+                conteos[clave] = conteos.get(clave, 0) + 1
+
+    return mapa
+
+
+def cargar_mapa_calor(ruta: str):
+    """
+    Lee un mapa de calor guardado.
+
+    Args:
+        ruta (str): Ruta al archivo JSON del mapa.
+
+    Returns:
+        dict: El mapa, o None si el archivo no existe.
+    """
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta) as archivo:
+        return json.load(archivo)
+
+
+def actualizar_mapa_calor(ruta: str, datos, tamano_parche: int = 300):
+    """
+    Suma las detecciones de una ejecución al mapa de calor guardado en disco.
+
+    Args:
+        ruta (str): Ruta al archivo JSON del mapa (se crea si no existe).
+        datos (iterable): Diccionarios con información sobre los códigos QR detectados.
+        tamano_parche (int): Lado de los tiles si el mapa es nuevo.
+    """
+    mapa = construir_mapa_calor(datos, tamano_parche, cargar_mapa_calor(ruta))
+    directorio = os.path.dirname(ruta)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    with open(ruta + '.tmp', 'w') as archivo:
+        json.dump(mapa, archivo, indent=2)
+    os.replace(ruta + '.tmp', ruta)
+
+
+class SeleccionParches:
+    """
+    Decide qué parches de cada frame se decodifican según las máscaras de interés y el mapa de calor.
+
+    Los parches fuera de los polígonos nunca se decodifican. Con mapa de calor, los parches calientes
+    se revisan en todos los frames; en modo 'priorizar' los fríos se revisan por turnos (todos cada
+    `periodo_auditoria` frames) y en modo 'restringir' solo en una auditoría completa cada `periodo_auditoria` frames.
+    """
+
+    def __init__(self, poligonos: list = None, mapa_calor: dict = None, modo: str = 'priorizar',
+                 periodo_auditoria: int = 50, umbral: int = 1):
+        if modo not in MODOS_MAPA_CALOR:
+            raise ValueError(f"Modo de mapa de calor no válido: {modo}. Use uno de {MODOS_MAPA_CALOR}.")
+        self.poligonos = poligonos
+        self.modo = modo
+        self.periodo_auditoria = max(1, periodo_auditoria)
+
+        # Rectángulos calientes en píxeles originales, ampliados un tile hacia cada lado para tolerar desplazamientos
+        self.rectangulos_calientes = None
+        if mapa_calor is not None:
+            tamano = mapa_calor['tamano_parche']
+            self.rectangulos_calientes = []
+            for clave, conteo in mapa_calor['conteos'].items():
+                if conteo >= umbral:
+                    columna, fila = map(int, clave.split(','))
+                    self.rectangulos_calientes.append(((columna - 1) * tamano, (fila - 1) * tamano,
+                                                       (columna + 2) * tamano, (fila + 2) * tamano))
+        self._clave = None
+
+    def _preparar(self, ancho: int, alto: int, tamano_parche: int, escala: float):
+        parches = grilla_parches(ancho, alto, tamano_parche)
+
+        if self.poligonos:
+            mascara = np.zeros((alto, ancho), np.uint8)
+            cv2.fillPoly(mascara, [np.round(np.array(p, np.float64) * escala).astype(np.int32) for p in self.poligonos], 255)
+            parches = [(x, y) for x, y in parches if mascara[y:y + tamano_parche, x:x + tamano_parche].any()]
+
+        if self.rectangulos_calientes is None:
+            self._calientes, self._frios = parches, []
+        else:
+            def es_caliente(x, y):
+                # Comparar el parche en píxeles originales contra los rectángulos calientes
+                x0, y0, x1, y1 = x / escala, y / escala, (x + tamano_parche) / escala, (y + tamano_parche) / escala
+                return any(x0 < rx1 and rx0 < x1 and y0 < ry1 and ry0 < y1
+                           for rx0, ry0, rx1, ry1 in self.rectangulos_calientes)
+            self._calientes = [p for p in parches if es_caliente(*p)]
+            self._frios = [p for p in parches if not es_caliente(*p)]
+
+        self._todos = parches
+        self._clave = (ancho, alto, tamano_parche, escala)
+
+    def parches_para_frame(self, frame_num: int, ancho: int, alto: int, tamano_parche: int, escala: float = 1.0):
+        """
+        Devuelve los parches a decodificar en un frame.
+
+        Args:
+            frame_num (int): Número de frame.
+            ancho (int): Ancho del frame decodificado.
+            alto (int): Alto del frame decodificado.
+            tamano_parche (int): Lado del parche en píxeles del frame decodificado.
+            escala (float): Factor de escala aplicado durante la decodificación.
+
+        Returns:
+            list: Lista de tuplas (x, y) con la esquina superior izquierda de cada parche.
+        """
+        if self._clave != (ancho, alto, tamano_parche, escala):
+            self._preparar(ancho, alto, tamano_parche, escala)
+
+        if not self._frios:
+            return self._todos
+        if self.modo == 'restringir':
+            return self._todos if frame_num % self.periodo_auditoria == 0 else self._calientes
+        # Priorizar: los fríos se reparten entre frames consecutivos y se cubren todos en cada período
+        return self._calientes + self._frios[frame_num % self.periodo_auditoria::self.periodo_auditoria]
+
+
+@click.command()
+@click.option('--csv', 'csvs', required=True, multiple=True, type=str, help='CSV de ejecuciones anteriores (puede repetirse)')
+@click.option('--mapa-calor', required=True, type=str, help='Archivo JSON del mapa de calor a crear o actualizar')
+@click.option('--tamano-parche', type=int, default=300, help='Lado de los tiles del mapa en píxeles (solo para mapas nuevos)')
+def main(csvs: tuple, mapa_calor: str, tamano_parche: int):
+    """
+    Construye o actualiza un mapa de calor de detecciones a partir de los CSV de ejecuciones anteriores.
+    """
+    for ruta_csv in csvs:
+        actualizar_mapa_calor(mapa_calor, leer_csv_detecciones(ruta_csv), tamano_parche)
+    mapa = cargar_mapa_calor(mapa_calor)
+    print(f"Mapa de calor con {len(mapa['conteos'])} tiles con detecciones guardado en {mapa_calor}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+import os
+import sys
+import json
+import shutil
+import filecmp
+import hashlib
+import tempfile
+import subprocess
+import multiprocessing
+import click
+from bounded_memory import procesar_chunk, ResultadosEnDisco
+from utils import dividir_en_rangos, alinear_rangos_a_keyframes, keyframes_disponibles
+from progreso import MonitorProgreso, inicializar_proceso
+from video_decoding import BACKENDS, obtener_info_video, listar_keyframes
+
+VERSION_MANIFIESTO = 1
+MARCADOR_SHARD = 'shard.json'
+
+
+def calcular_hash(video_path: str, tamano_bloque: int = 2**24):
+    """
+    Calcula el hash SHA-256 del contenido de un archivo.
+
+    Args:
+        video_path (str): Ruta al archivo.
+        tamano_bloque (int): Bytes leídos por vez.
+
+    Returns:
+        str: Hash en hexadecimal.
+    """
+    sha = hashlib.sha256()
+    with open(video_path, 'rb') as archivo:
+        for bloque in iter(lambda: archivo.read(tamano_bloque), b''):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+def alinear_a_keyframes(total_frames: int, num_shards: int, keyframes: list = None):
+    """
+    Calcula los límites de los shards, desplazando cada corte ideal al keyframe más cercano.
+
+    Args:
+        total_frames (int): Cantidad total de frames del video.
+        num_shards (int): Cantidad de shards deseada.
+        keyframes (list): Números de frame de los keyframes. Si es None los cortes quedan uniformes.
+
+    Returns:
+        list: Lista de tuplas (frame inicial, frame final). Puede tener menos de `num_shards` elementos
+            si varios cortes caen en el mismo keyframe.
+    """
+    cortes = [inicio for inicio, _ in dividir_en_rangos(total_frames, num_shards)]
+    if keyframes:
+        cortes = [min(keyframes, key=lambda k: abs(k - corte)) for corte in cortes]
+
+    cortes = sorted(set(c for c in cortes if 0 < c < total_frames) | {0})
+    return list(zip(cortes, cortes[1:] + [total_frames]))
+
+
+def planificar_shards(video_path: str, num_shards: int, modo: str = 'hibrido', backend: str = 'opencv',
+                      escala: float = 1.0, hilos: int = 0):
+    """
+    Arma el manifiesto de shards de un video.
+
+    Args:
+        video_path (str): Ruta al archivo de video.
+        num_shards (int): Cantidad de shards deseada.
+        modo (str): Modo de procesamiento ('hibrido' o 'pyzbar').
+        backend (str): Backend de decodificación.
+        escala (float): Factor de escala aplicado durante la decodificación.
+        hilos (int): Hilos del decodificador.
+
+    Returns:
+        dict: Manifiesto con el video, los parámetros de procesamiento y los rangos de cada shard.
+    """
+    info = obtener_info_video(video_path)
+    try:
+        keyframes = listar_keyframes(video_path)
+    except ImportError as e:
+        print(f"No se pudieron listar los keyframes ({e}); los shards quedan con cortes uniformes.")
+        keyframes = None
+
+    rangos = alinear_a_keyframes(info['total_frames'], num_shards, keyframes)
+    return {
+        'version': VERSION_MANIFIESTO,
+        'video': dict(info, nombre=os.path.basename(video_path), sha256=calcular_hash(video_path)),
+        'parametros': {'modo': modo, 'backend': backend, 'escala': escala, 'hilos': hilos},
+        'alineado_a_keyframes': keyframes is not None,
+        'shards': [{'id': i, 'start_frame': start, 'end_frame': end} for i, (start, end) in enumerate(rangos)]
+    }
+
+
+def directorio_shard(salida: str, shard_id: int):
+    return os.path.join(salida, f'shard_{shard_id:05d}')
+
+
+def ejecutar_shard(manifiesto: dict, shard_id: int, video_path: str, salida: str, num_processes: int = 1,
+                   frames_por_chunk: int = 500, hilos_opencv: int = None, verificar_hash: bool = True, hilos_parches: int = 1,
+                   progreso_jsonl: str = None):
+    """
+    Procesa un shard del manifiesto en esta máquina.
+
+    Las detecciones se vuelcan en chunks JSONL dentro del directorio del shard y, al terminar, se escribe un
+    marcador que indica que el shard está completo. Un shard sin marcador se considera pendiente.
+
+    Args:
+        manifiesto (dict): Manifiesto generado por `planificar_shards`.
+        shard_id (int): Identificador del shard a procesar.
+        video_path (str): Ruta local al video (debe tener el mismo contenido que el del manifiesto).
+        salida (str): Directorio donde se guardan los resultados de los shards.
+        num_processes (int): Procesos a utilizar en esta máquina.
+        frames_por_chunk (int): Tamaño de los chunks en que se divide el shard.
+        hilos_opencv (int): Hilos internos de OpenCV en cada proceso.
+        verificar_hash (bool): Comprueba que el video local coincida con el del manifiesto.
+        hilos_parches (int): Hilos por proceso que decodifican en paralelo los parches de cada frame (modo híbrido).
+        progreso_jsonl (str): Archivo al que se agregan los eventos de progreso en formato JSONL (opcional).
+    """
+    if verificar_hash and calcular_hash(video_path) != manifiesto['video']['sha256']:
+        raise ValueError(f"El contenido de {video_path} no coincide con el hash del manifiesto.")
+
+    shard = manifiesto['shards'][shard_id]
+    parametros = manifiesto['parametros']
+    directorio = directorio_shard(salida, shard_id)
+    os.makedirs(directorio, exist_ok=True)
+    # Si el shard se vuelve a ejecutar, queda pendiente hasta terminar de nuevo
+    if os.path.exists(os.path.join(directorio, MARCADOR_SHARD)):
+        os.remove(os.path.join(directorio, MARCADOR_SHARD))
+    log_path = os.path.join(directorio, 'log.txt')
+
+    chunks = [(shard['start_frame'] + inicio, shard['start_frame'] + fin)
+              for inicio, fin in dividir_en_rangos(shard['end_frame'] - shard['start_frame'], num_processes, frames_por_chunk)]
+    # Cada chunk empieza en un keyframe para no decodificar frames que se descartan
+    chunks = alinear_rangos_a_keyframes(chunks, keyframes_disponibles(video_path))
+    print(f"Procesando shard {shard_id} (frames {shard['start_frame']} a {shard['end_frame'] - 1}) "
+          f"con {num_processes} núcleos en {len(chunks)} chunks...")
+
+    with MonitorProgreso(shard['end_frame'] - shard['start_frame'], num_processes, progreso_jsonl,
+                         etiqueta=f'shard_{shard_id:05d}') as monitor:
+        pool = multiprocessing.Pool(processes=num_processes, initializer=inicializar_proceso, initargs=monitor.initargs(hilos_opencv))
+        rutas = pool.starmap(procesar_chunk, [(parametros['modo'], video_path, log_path, directorio, start, end, directorio,
+                                               parametros['backend'], parametros['escala'], parametros['hilos'], None, hilos_parches)
+                                              for start, end in chunks], chunksize=1)
+        pool.close()
+        pool.join()
+
+    with open(os.path.join(directorio, MARCADOR_SHARD), 'w') as archivo:
+        json.dump({'shard': shard, 'sha256': manifiesto['video']['sha256'],
+                   'chunks': [os.path.basename(ruta) for ruta in rutas]}, archivo, indent=2)
+
+
+def unir_shards(manifiesto: dict, salida: str):
+    """
+    Reúne los resultados de todos los shards en orden de frame.
+
+    Args:
+        manifiesto (dict): Manifiesto generado por `planificar_shards`.
+        salida (str): Directorio donde están los resultados de los shards.
+
+    Returns:
+        ResultadosEnDisco: Detecciones de todos los shards, iterables en orden de frame.
+    """
+    rutas = []
+    faltantes = []
+    for shard in manifiesto['shards']:
+        directorio = directorio_shard(salida, shard['id'])
+        try:
+            with open(os.path.join(directorio, MARCADOR_SHARD)) as archivo:
+                marcador = json.load(archivo)
+        except OSError:
+            faltantes.append(shard['id'])
+            continue
+
+        if marcador['sha256'] != manifiesto['video']['sha256'] or marcador['shard'] != shard:
+            raise ValueError(f"El shard {shard['id']} en {directorio} no corresponde a este manifiesto.")
+        rutas.extend(os.path.join(directorio, nombre) for nombre in sorted(marcador['chunks']))
+
+    if faltantes:
+        raise ValueError(f"Faltan completar los shards: {faltantes}")
+
+    # Los shards no se solapan y los chunks se nombran por frame inicial, por lo que este orden es el del video.
+    # Los chunks son de los shards: limpiar los resultados no debe borrarlos
+    return ResultadosEnDisco(None, rutas)
+
+
+def reunir_frames(manifiesto: dict, salida: str, output_path: str):
+    """
+    Reúne en `output_path/qr_frames` los frames con los QR dibujados que el modo híbrido guarda en cada shard,
+    igual que en una ejecución en una sola máquina. Se usan enlaces duros si es posible y copias si no.
+
+    Args:
+        manifiesto (dict): Manifiesto generado por `planificar_shards`.
+        salida (str): Directorio donde están los resultados de los shards.
+        output_path (str): Directorio de salida.
+
+    Returns:
+        int: Cantidad de frames reunidos.
+    """
+    destino = os.path.join(output_path, 'qr_frames')
+    os.makedirs(destino, exist_ok=True)
+    cantidad = 0
+    for shard in manifiesto['shards']:
+        origen = os.path.join(directorio_shard(salida, shard['id']), 'qr_frames')
+        if not os.path.isdir(origen):
+            continue
+        for nombre in os.listdir(origen):
+            ruta_destino = os.path.join(destino, nombre)
+            if os.path.exists(ruta_destino):
+                os.remove(ruta_destino)
+            try:
+                os.link(os.path.join(origen, nombre), ruta_destino)
+            except OSError:
+                shutil.copy2(os.path.join(origen, nombre), ruta_destino)
+            cantidad += 1
+    return cantidad
+
+
+def _comparar_directorios(directorio_a: str, directorio_b: str):
+    """
+    Devuelve los nombres de archivo que faltan en alguno de los dos directorios o cuyo contenido difiere.
+    """
+    nombres_a = set(os.listdir(directorio_a)) if os.path.isdir(directorio_a) else set()
+    nombres_b = set(os.listdir(directorio_b)) if os.path.isdir(directorio_b) else set()
+    distintos = nombres_a ^ nombres_b
+    distintos.update(nombre for nombre in nombres_a & nombres_b
+                     if not filecmp.cmp(os.path.join(directorio_a, nombre), os.path.join(directorio_b, nombre), shallow=False))
+    return sorted(distintos)
+
+
+@click.group()
+def cli():
+    """
+    Procesamiento de un video repartido en shards entre varias máquinas: plan, run-shard y merge.
+    """
+
+
+@cli.command()
+@click.option('--video-path', required=True, type=str, help='Ruta al archivo de video')
+@click.option('--manifiesto', required=True, type=str, help='Ruta del manifiesto JSON a generar')
+@click.option('--num-shards', required=True, type=int, help='Cantidad de shards deseada')
+@click.option('--modo', type=click.Choice(['pyzbar', 'hibrido'], case_sensitive=False), default='hibrido', help='Modo de procesamiento: pyzbar o híbrido')
+@click.option('--backend', type=click.Choice(BACKENDS, case_sensitive=False), default='opencv', help='Backend de decodificación del video')
+@click.option('--escala-decodificacion', type=float, default=1.0, help='Factor de escala aplicado por el decodificador')
+@click.option('--hilos-decodificacion', type=int, default=0, help='Hilos del decodificador en cada proceso (0 = automático)')
+def plan(video_path: str, manifiesto: str, num_shards: int, modo: str, backend: str, escala_decodificacion: float, hilos_decodificacion: int):
+    """
+    Genera el manifiesto de shards de un video.
+    """
+    plan_shards = planificar_shards(video_path, num_shards, modo, backend, escala_decodificacion, hilos_decodificacion)
+    with open(manifiesto, 'w') as archivo:
+        json.dump(plan_shards, archivo, indent=2)
+    print(f"Manifiesto con {len(plan_shards['shards'])} shards guardado en {manifiesto}")
+
+
+@cli.command('run-shard')
+@click.option('--manifiesto', required=True, type=str, help='Ruta al manifiesto JSON')
+@click.option('--shard', 'shard_id', required=True, type=int, help='Identificador del shard a procesar')
+@click.option('--salida', required=True, type=str, help='Directorio donde guardar los resultados de los shards')
+@click.option('--video-path', type=str, default=None, help='Ruta local al video (por defecto el nombre del manifiesto en el directorio actual)')
+@click.option('--num-processes', type=int, default=1, help='Número de procesos a utilizar en esta máquina')
+@click.option('--frames-por-chunk', type=int, default=500, help='Tamaño de los chunks en que se divide el shard')
+@click.option('--hilos-opencv', type=int, default=None, help='Hilos internos de OpenCV en cada proceso')
+@click.option('--sin-verificar-hash', is_flag=True, help='No comprobar que el video local coincida con el del manifiesto')
+@click.option('--hilos-por-proceso', type=int, default=1, help='Hilos por proceso que decodifican en paralelo los parches de cada frame (modo híbrido)')
+@click.option('--progreso-jsonl', type=str, default=None, help='Archivo al que se agregan los eventos de progreso en formato JSONL')
+def run_shard(manifiesto: str, shard_id: int, salida: str, video_path: str, num_processes: int, frames_por_chunk: int,
+              hilos_opencv: int, sin_verificar_hash: bool, hilos_por_proceso: int, progreso_jsonl: str):
+    """
+    Procesa un shard del manifiesto.
+    """
+    with open(manifiesto) as archivo:
+        plan_shards = json.load(archivo)
+    ejecutar_shard(plan_shards, shard_id, video_path or plan_shards['video']['nombre'], salida, num_processes,
+                   frames_por_chunk, hilos_opencv, not sin_verificar_hash, hilos_por_proceso, progreso_jsonl)
+
+
+@cli.command()
+@click.option('--manifiesto', required=True, type=str, help='Ruta al manifiesto JSON')
+@click.option('--salida', required=True, type=str, help='Directorio con los resultados de los shards')
+@click.option('--output-path', type=str, default="output/", help='Directorio de salida')
+@click.option('--salida-csv', required=True, type=str, help='Ruta al archivo CSV de salida')
+@click.option('--prefijo', type=str, default="", help='Prefijo para los nombres de los frames del video en el csv')
+@click.option('--video-path', type=str, default=None, help='Ruta local al video, necesaria solo para generar el video de salida')
+@click.option('--generar-video', is_flag=True, help='Indica si se debe generar un video con los recuadros de los códigos QR detectados')
+@click.option('--output-video', type=str, default="output_video.mp4", help='Ruta del archivo de video de salida con los recuadros de los QR detectados (si se genera)')
+@click.option('--factor-lentitud', type=float, default=0.5, help='Factor para ralentizar el video (menor a 1 lo hará más lento, mayor a 1 lo hará más rápido)')
+def merge(manifiesto: str, salida: str, output_path: str, salida_csv: str, prefijo: str, video_path: str, generar_video: bool,
+          output_video: str, factor_lentitud: float):
+    """
+    Une los resultados de todos los shards y genera las mismas salidas que una ejecución en una sola máquina.
+    """
+    from main import generar_salidas
+
+    with open(manifiesto) as archivo:
+        plan_shards = json.load(archivo)
+
+    os.makedirs(output_path, exist_ok=True)
+    datos = unir_shards(plan_shards, salida)
+    generar_salidas(datos, video_path or plan_shards['video']['nombre'], output_path, salida_csv, prefijo,
+                    generar_video, output_video, factor_lentitud)
+
+    if plan_shards['parametros']['modo'] == 'hibrido':
+        cantidad = reunir_frames(plan_shards, salida, output_path)
+        print(f"{cantidad} frames de los shards reunidos en {os.path.join(output_path, 'qr_frames')}")
+
+
+@cli.command()
+@click.option('--video-path', required=True, type=str, help='Ruta al archivo de video')
+@click.option('--num-shards', type=int, default=3, help='Cantidad de shards (cada uno se procesa en un proceso independiente)')
+@click.option('--modo', type=click.Choice(['pyzbar', 'hibrido'], case_sensitive=False), default='hibrido', help='Modo de procesamiento: pyzbar o híbrido')
+@click.option('--backend', type=click.Choice(BACKENDS, case_sensitive=False), default='opencv', help='Backend de decodificación del video')
+@click.option('--directorio', type=str, default=None, help='Directorio de trabajo a conservar (por defecto uno temporal que se borra al terminar)')
+def verificar(video_path: str, num_shards: int, modo: str, backend: str, directorio: str):
+    """
+    Comprueba localmente que plan, run-shard (un proceso independiente por shard) y merge producen el mismo CSV
+    (y en modo híbrido los mismos frames) que una ejecución en una sola máquina.
+    """
+    script = os.path.abspath(__file__)
+    script_main = os.path.join(os.path.dirname(script), 'main.py')
+    trabajo = directorio or tempfile.mkdtemp(prefix='qr_shards_')
+    os.makedirs(trabajo, exist_ok=True)
+    manifiesto = os.path.join(trabajo, 'plan.json')
+    salida = os.path.join(trabajo, 'shards')
+    salida_unida = os.path.join(trabajo, 'unido')
+    salida_unica = os.path.join(trabajo, 'unico')
+
+    try:
+        subprocess.run([sys.executable, script, 'plan', '--video-path', video_path, '--manifiesto', manifiesto,
+                        '--num-shards', str(num_shards), '--modo', modo, '--backend', backend], check=True)
+        with open(manifiesto) as archivo:
+            plan_shards = json.load(archivo)
+
+        # Cada shard en un proceso independiente, como si fuera otra máquina
+        procesos = [subprocess.Popen([sys.executable, script, 'run-shard', '--manifiesto', manifiesto, '--shard', str(shard['id']),
+                                      '--salida', salida, '--video-path', video_path], stdout=subprocess.DEVNULL)
+                    for shard in plan_shards['shards']]
+        fallidos = [shard_id for shard_id, proceso in enumerate(procesos) if proceso.wait() != 0]
+        if fallidos:
+            raise click.ClickException(f"Fallaron los shards {fallidos}.")
+
+        subprocess.run([sys.executable, script, 'merge', '--manifiesto', manifiesto, '--salida', salida,
+                        '--output-path', salida_unida, '--salida-csv', 'datos.csv'], check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([sys.executable, script_main, '--video-path', video_path, '--output-path', salida_unica + '/',
+                        '--salida-csv', 'datos.csv', '--log-path', 'log.txt', '--modo', modo, '--backend', backend],
+                       check=True, stdout=subprocess.DEVNULL)
+
+        diferencias = []
+        if not filecmp.cmp(os.path.join(salida_unida, 'datos.csv'), os.path.join(salida_unica, 'datos.csv'), shallow=False):
+            diferencias.append('datos.csv')
+        if modo == 'hibrido':
+            diferencias += [f'qr_frames/{nombre}' for nombre in _comparar_directorios(os.path.join(salida_unida, 'qr_frames'),
+                                                                                      os.path.join(salida_unica, 'qr_frames'))]
+    finally:
+        if directorio is None:
+            shutil.rmtree(trabajo, ignore_errors=True)
+
+    if diferencias:
+        raise click.ClickException(f"Las salidas de los shards difieren de la ejecución en una sola máquina: {diferencias[:10]}")
+    print(f"OK: {len(plan_shards['shards'])} shards producen las mismas salidas que una ejecución en una sola máquina.")
+
+
+if __name__ == "__main__":
+    multiprocessing.set_start_method("spawn")
+    cli()
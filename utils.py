@@ -1,8 +1,16 @@
 import pandas as pd
 import numpy as np
+import tempfile
+import shutil
+import heapq
+import itertools
+import json
 import time
+import bisect
+import csv
 import cv2
 import os
+from video_decoding import listar_keyframes
 
 def mide_tiempo(funcion):
     """
@@ -21,6 +29,85 @@ def mide_tiempo(funcion):
         return c
     return funcion_medida
 
+def configurar_hilos_opencv(hilos: int = None):
+    """
+    Inicializador de procesos de trabajo que fija la cantidad de hilos internos de OpenCV.
+
+    Args:
+        hilos (int): Hilos que puede usar OpenCV en el proceso. Si es None se mantiene el valor por defecto.
+    """
+    if hilos is not None:
+        cv2.setNumThreads(hilos)
+
+
+def dividir_en_rangos(total_frames: int, num_processes: int, tamano_chunk: int = None):
+    """
+    Divide un video en rangos de frames para repartir entre procesos.
+
+    Args:
+        total_frames (int): Cantidad total de frames del video.
+        num_processes (int): Número de procesos.
+        tamano_chunk (int): Si se indica, rangos de este tamaño para planificación dinámica; si no, un rango por proceso.
+
+    Returns:
+        list: Lista de tuplas (frame inicial, frame final).
+    """
+    if tamano_chunk:
+        return [(inicio, min(inicio + tamano_chunk, total_frames)) for inicio in range(0, total_frames, tamano_chunk)]
+
+    frame_ranges = [(i * (total_frames // num_processes), (i + 1) * (total_frames // num_processes)) for i in range(num_processes)]
+    frame_ranges[-1] = (frame_ranges[-1][0], total_frames)  # Asegurarse de que el último proceso llegue hasta el final
+    return frame_ranges
+
+
+def alinear_rangos_a_keyframes(rangos: list, keyframes: list = None):
+    """
+    Mueve el inicio de cada rango, salvo el primero, al último keyframe que no lo supera, para que cada rango
+    empiece a decodificarse en un keyframe en lugar de decodificar y descartar los frames previos.
+
+    Un corte no se mueve si el keyframe está más lejos que el largo de su rango, para que los rangos no crezcan
+    sin límite en videos con pocos keyframes. Los rangos que quedan vacíos se unen al anterior.
+
+    Args:
+        rangos (list): Lista de tuplas (frame inicial, frame final) contiguas y ordenadas.
+        keyframes (list): Números de frame de los keyframes, en orden. Si es None los rangos no cambian.
+
+    Returns:
+        list: Lista de tuplas (frame inicial, frame final) con los mismos frames en total.
+    """
+    if not keyframes or not rangos:
+        return rangos
+
+    cortes = [rangos[0][0]]
+    for inicio, fin in rangos[1:]:
+        i = bisect.bisect_right(keyframes, inicio) - 1
+        if i >= 0 and inicio - keyframes[i] < fin - inicio:
+            inicio = keyframes[i]
+        if inicio > cortes[-1]:
+            cortes.append(inicio)
+    return list(zip(cortes, cortes[1:] + [rangos[-1][1]]))
+
+
+def keyframes_disponibles(video_path: str):
+    """
+    Lista los keyframes del video para alinear los rangos de trabajo, o devuelve None si PyAV no está instalado.
+    """
+    try:
+        return listar_keyframes(video_path)
+    except ImportError:
+        print("Advertencia: PyAV no está instalado (pip install av); los rangos no se alinean a keyframes y, con el "
+              "backend opencv en el modo híbrido, cada rango se decodifica desde el inicio del video.")
+        return None
+
+
+def dividir_en_rangos_alineados(video_path: str, total_frames: int, num_processes: int, tamano_chunk: int = None):
+    """
+    Igual que `dividir_en_rangos`, pero con los cortes alineados a los keyframes del video.
+    """
+    return alinear_rangos_a_keyframes(dividir_en_rangos(total_frames, num_processes, tamano_chunk),
+                                      keyframes_disponibles(video_path))
+
+
 def extraer_frames(video_path: str, output_dir: str):
     """
     Extrae todos los frames de un video y los guarda como imágenes en disco.
@@ -45,6 +132,35 @@ def extraer_frames(video_path: str, output_dir: str):
     print(f"Se han guardado {frame_num} frames en {output_dir}")
 
 
+COLUMNAS_CSV = ["image_name", "x", "y", "r", "detection", "track_id", "label", "data", "esquina"]
+MAX_RUNS_ABIERTOS = 256
+
+
+def _filas_csv(row, prefijo):
+    """
+    Expande una detección en las cuatro filas (una por esquina) del CSV de salida.
+    """
+    for i in range(1, 5):  # Genera x1,y1 hasta x4,y4
+        yield {
+            "image_name": f"{prefijo}_{row['frame']}.png",
+            "x": row[f"x{i}"],
+            "y": row[f"y{i}"],
+            "r": 0,
+            "detection": row["detected_by"],
+            "track_id": 1000 + int(row["data"]) * 4 + i -1,
+            "label": "qr",
+            "data": int(row["data"]),
+            "esquina": i
+        }
+
+
+_INDICES_ORDEN_CSV = [COLUMNAS_CSV.index(columna) for columna in ('data', 'image_name', 'esquina')]
+
+
+def _clave_orden_csv(fila):
+    return [fila[i] for i in _INDICES_ORDEN_CSV]
+
+
 def generar_csv(datos, prefijo, salida_csv: str):
     """
     Genera un archivo CSV con los datos de los códigos QR detectados.
@@ -54,31 +170,105 @@ def generar_csv(datos, prefijo, salida_csv: str):
         prefijo (str): prefijo para formar el nombre de cada frame
         salida_csv (str): Ruta del archivo CSV de salida.
     """
-    rows = []
-    for row in datos:
-        for i in range(1, 5):  # Genera x1,y1 hasta x4,y4
-            rows.append({
-                "image_name": f"{prefijo}_{row['frame']}.png",
-                "x": row[f"x{i}"],
-                "y": row[f"y{i}"],
-                "r": 0,
-                "detection": row["detected_by"],
-                "track_id": 1000 + int(row["data"]) * 4 + i -1,
-                "label": "qr",
-                "data": int(row["data"]),
-                "esquina": i
-            })
+    rows = [fila for row in datos for fila in _filas_csv(row, prefijo)]
     df = pd.DataFrame(rows)
     df = df.sort_values(by=['data', 'image_name', 'esquina'])
     df.to_csv(salida_csv, index=False)
 
+
+def leer_csv_detecciones(ruta_csv: str):
+    """
+    Reconstruye las detecciones a partir de un CSV generado por `generar_csv`, agrupando las cuatro esquinas.
+
+    Args:
+        ruta_csv (str): Ruta al archivo CSV.
+
+    Yields:
+        dict: Diccionario con 'frame', 'data', 'x1'..'y4' y 'detected_by' de cada detección.
+    """
+    with open(ruta_csv, newline='') as archivo:
+        # El CSV está ordenado por data e image_name, así que las filas de cada QR en cada frame son contiguas
+        for (image_name, data), filas in itertools.groupby(csv.DictReader(archivo), key=lambda f: (f['image_name'], f['data'])):
+            esquinas = {i: [] for i in range(1, 5)}
+            for fila in filas:
+                esquinas[int(fila['esquina'])].append(fila)
+
+            # El nombre de la imagen es '<prefijo>_<frame>.png'
+            frame = int(image_name.rsplit('_', 1)[1][:-len('.png')])
+            for fila_1, fila_2, fila_3, fila_4 in zip(*esquinas.values()):
+                item = {'frame': frame, 'data': data, 'detected_by': fila_1['detection']}
+                for i, fila in enumerate((fila_1, fila_2, fila_3, fila_4), start=1):
+                    item[f'x{i}'] = int(fila['x'])
+                    item[f'y{i}'] = int(fila['y'])
+                yield item
+
+
+def _escribir_run(filas, directorio: str):
+    """
+    Escribe una secuencia ordenada de filas en un archivo temporal y devuelve su ruta.
+    """
+    descriptor, ruta = tempfile.mkstemp(suffix='.jsonl', dir=directorio)
+    with os.fdopen(descriptor, 'w') as archivo:
+        for fila in filas:
+            archivo.write(json.dumps(fila) + '\n')
+    return ruta
+
+
+def _leer_run(ruta: str):
+    with open(ruta) as archivo:
+        for linea in archivo:
+            yield json.loads(linea)
+
+
+def _mezclar_runs(rutas: list):
+    """
+    Mezcla archivos de filas ordenadas en un único flujo ordenado.
+    """
+    return heapq.merge(*[_leer_run(ruta) for ruta in rutas], key=_clave_orden_csv)
+
+
+def generar_csv_por_chunks(chunks, prefijo, salida_csv: str, directorio_temporal: str = None):
+    """
+    Genera el mismo CSV que `generar_csv` consumiendo las detecciones de a un chunk por vez.
+
+    Cada chunk se ordena por separado y se escribe en disco; luego los chunks ordenados se mezclan en
+    flujo (ordenamiento externo), por lo que la memoria usada depende del tamaño del chunk y no del video.
+
+    Args:
+        chunks (iterable): Iterable de listas de detecciones, en orden de frame.
+        prefijo (str): prefijo para formar el nombre de cada frame
+        salida_csv (str): Ruta del archivo CSV de salida.
+        directorio_temporal (str): Directorio para los archivos intermedios (por defecto el temporal del sistema).
+    """
+    directorio = tempfile.mkdtemp(prefix='qr_csv_', dir=directorio_temporal)
+    try:
+        runs = []
+        for chunk in chunks:
+            filas = [[fila[c] for c in COLUMNAS_CSV] for row in chunk for fila in _filas_csv(row, prefijo)]
+            filas.sort(key=_clave_orden_csv)
+            runs.append(_escribir_run(filas, directorio))
+
+        # Limitar la cantidad de archivos abiertos a la vez mezclando por tandas
+        while len(runs) > MAX_RUNS_ABIERTOS:
+            runs = [_escribir_run(_mezclar_runs(runs[i:i + MAX_RUNS_ABIERTOS]), directorio)
+                    for i in range(0, len(runs), MAX_RUNS_ABIERTOS)]
+
+        with open(salida_csv, 'w', newline='') as archivo:
+            writer = csv.writer(archivo, lineterminator=os.linesep)
+            writer.writerow(COLUMNAS_CSV)
+            writer.writerows(_mezclar_runs(runs))
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
 def generar_video_con_qr(video_path: str, datos: list, output_video_path: str, factor_lentitud: float = 0.5):
     """
     Genera un nuevo video dibujando polígonos alrededor de los códigos QR detectados.
 
+    Las detecciones se consumen en flujo a medida que avanza el video, por lo que deben estar ordenadas por frame.
+
     Args:
         video_path (str): Ruta al archivo de video original.
-        datos (list): Lista de diccionarios con información sobre los códigos QR detectados.
+        datos (iterable): Diccionarios con información sobre los códigos QR detectados, ordenados por frame.
         output_video_path (str): Ruta para guardar el video con los recuadros dibujados.
         factor_lentitud (float): Factor para ralentizar el video. Menor a 1 hará que el video sea más lento.
     """
@@ -91,13 +281,8 @@ def generar_video_con_qr(video_path: str, datos: list, output_video_path: str, f
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     out = cv2.VideoWriter(output_video_path, fourcc, slow_fps, (frame_width, frame_height))
 
-    qr_data_by_frame = {}
-    for item in datos:
-        frame_num = item['frame']
-        if frame_num not in qr_data_by_frame:
-            qr_data_by_frame[frame_num] = []
-        qr_data_by_frame[frame_num].append(item)
-
+    detecciones = iter(datos)
+    qr = next(detecciones, None)
     frame_num = 0
 
     while cap.isOpened():
@@ -105,17 +290,21 @@ def generar_video_con_qr(video_path: str, datos: list, output_video_path: str, f
         if not ret:
             break
 
-        if frame_num in qr_data_by_frame:
-            for qr in qr_data_by_frame[frame_num]:
-                pts = [(qr['x1'], qr['y1']), (qr['x2'], qr['y2']),
-                       (qr['x3'], qr['y3']), (qr['x4'], qr['y4'])]
+        # Avanzar el flujo de detecciones hasta el frame actual
+        while qr is not None and qr['frame'] < frame_num:
+            qr = next(detecciones, None)
+
+        while qr is not None and qr['frame'] == frame_num:
+            pts = [(qr['x1'], qr['y1']), (qr['x2'], qr['y2']),
+                   (qr['x3'], qr['y3']), (qr['x4'], qr['y4'])]
 
-                color = (0, 255, 0)
-                cv2.polylines(frame, [np.array(pts)], isClosed=True, color=color, thickness=2)
+            color = (0, 255, 0)
+            cv2.polylines(frame, [np.array(pts)], isClosed=True, color=color, thickness=2)
 
-                text = qr['data']
-                cv2.putText(frame, text, (pts[0][0], pts[0][1] - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+            text = qr['data']
+            cv2.putText(frame, text, (pts[0][0], pts[0][1] - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+            qr = next(detecciones, None)
 
         out.write(frame)
         frame_num += 1
@@ -0,0 +1,401 @@
+import os
+import cv2
+import sys
+import time
+import bisect
+import subprocess
+import numpy as np
+import click
+from collections import namedtuple
+from functools import lru_cache
+
+
+BACKENDS = ('opencv', 'pyav', 'ffmpeg')
+
+# Formato de pixel por defecto de cada backend: OpenCV entrega BGR y los backends
+# basados en FFmpeg entregan directamente la luminancia, sin conversión posterior
+FORMATO_POR_DEFECTO = {'opencv': 'bgr', 'pyav': 'gray', 'ffmpeg': 'gray'}
+
+_FORMATOS_PYAV = {'gray': 'gray', 'bgr': 'bgr24'}
+_FORMATOS_FFMPEG = {'gray': 'gray', 'bgr': 'bgr24'}
+_CANALES = {'gray': 1, 'bgr': 3}
+
+# PTS de todos los frames en orden de presentación y números de los keyframes (ver `indice_frames`)
+IndiceFrames = namedtuple('IndiceFrames', ['pts', 'keyframes', 'time_base', 'inicio_pts', 'inicio_archivo'])
+
+
+def obtener_info_video(video_path: str):
+    """
+    Obtiene los parámetros básicos de un video.
+
+    Args:
+        video_path (str): Ruta al archivo de video.
+
+    Returns:
+        dict: Diccionario con 'total_frames', 'fps', 'ancho' y 'alto'.
+    """
+    cap = cv2.VideoCapture(video_path)
+    info = {
+        'total_frames': int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+        'fps': cap.get(cv2.CAP_PROP_FPS),
+        'ancho': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'alto': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+    }
+    cap.release()
+    return info
+
+
+def dimensiones_escaladas(ancho: int, alto: int, escala: float = 1.0):
+    """
+    Calcula las dimensiones de un frame luego de aplicar un factor de escala.
+
+    Args:
+        ancho (int): Ancho original en píxeles.
+        alto (int): Alto original en píxeles.
+        escala (float): Factor de escala (1.0 conserva la resolución original).
+
+    Returns:
+        tuple: (ancho, alto) escalados.
+    """
+    return max(1, int(round(ancho * escala))), max(1, int(round(alto * escala)))
+
+
+def iterar_frames(video_path: str, start_frame: int = 0, end_frame: int = None, backend: str = 'opencv',
+                  formato: str = None, escala: float = 1.0, hilos: int = 0, busqueda_exacta: bool = False):
+    """
+    Decodifica un rango de frames de un video con el backend indicado.
+
+    Args:
+        video_path (str): Ruta al archivo de video.
+        start_frame (int): Primer frame a entregar.
+        end_frame (int): Frame final (excluido). Si es None se decodifica hasta el final del video.
+        backend (str): 'opencv', 'pyav' o 'ffmpeg'.
+        formato (str): 'gray' o 'bgr'. Si es None se usa el formato nativo del backend.
+        escala (float): Factor de escala aplicado durante la decodificación.
+        hilos (int): Hilos del decodificador (0 deja que FFmpeg elija). OpenCV lo ignora.
+        busqueda_exacta (bool): Con OpenCV, salta al keyframe anterior a `start_frame` y avanza identificando cada
+            frame por su timestamp en lugar de usar CAP_PROP_POS_FRAMES, que puede caer en un frame equivocado en
+            videos H.264 o de frame rate variable. PyAV y FFmpeg siempre buscan así y lo ignoran.
+
+    Yields:
+        tuple: (número de frame, frame como arreglo numpy).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend de decodificación no válido: {backend}. Use uno de {BACKENDS}.")
+    formato = formato or FORMATO_POR_DEFECTO[backend]
+    if formato not in _CANALES:
+        raise ValueError(f"Formato de pixel no válido: {formato}. Use 'gray' o 'bgr'.")
+    if end_frame is None:
+        end_frame = sys.maxsize
+
+    if backend == 'opencv':
+        yield from _iterar_frames_opencv(video_path, start_frame, end_frame, formato, escala, busqueda_exacta)
+    elif backend == 'pyav':
+        yield from _iterar_frames_pyav(video_path, start_frame, end_frame, formato, escala, hilos)
+    else:
+        yield from _iterar_frames_ffmpeg(video_path, start_frame, end_frame, formato, escala, hilos)
+
+
+def _iterar_frames_opencv(video_path: str, start_frame: int, end_frame: int, formato: str, escala: float,
+                          busqueda_exacta: bool = False):
+    cap = cv2.VideoCapture(video_path)
+    capturado = False
+    if busqueda_exacta:
+        capturado = _posicionar_opencv(cap, video_path, start_frame)
+        if not capturado:
+            cap.release()
+            return
+    else:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    frame_num = start_frame
+
+    try:
+        while frame_num < end_frame and cap.isOpened():
+            # El primer frame de la búsqueda exacta ya quedó capturado con grab()
+            if not capturado and not cap.grab():
+                break
+            capturado = False
+            ret, frame = cap.retrieve()
+            if not ret:
+                break
+
+            if formato == 'gray':
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if escala != 1.0:
+                frame = cv2.resize(frame, dimensiones_escaladas(frame.shape[1], frame.shape[0], escala),
+                                   interpolation=cv2.INTER_AREA)
+
+            yield frame_num, frame
+            frame_num += 1
+    finally:
+        cap.release()
+
+
+def _posicionar_opencv(cap, video_path: str, start_frame: int):
+    """
+    Deja capturado con grab() el frame `start_frame` identificando por su timestamp cada frame decodificado.
+
+    OpenCV numera los frames como timestamp × fps promedio, por lo que en videos H.264 o de frame rate variable
+    su búsqueda puede caer antes o después del frame pedido. Se le pide el keyframe anterior y se avanza con
+    grab(), que decodifica sin convertir ni copiar el frame; si la búsqueda cae después del frame pedido se prueba
+    con el keyframe previo. Sin PyAV, o si ninguna búsqueda sirve, se decodifica desde el inicio del video.
+
+    Returns:
+        bool: True si el frame quedó capturado, False si el video termina antes.
+    """
+    indice = _indice_opcional(video_path) if start_frame > 0 else None
+    if indice is not None:
+        if start_frame >= len(indice.pts):
+            return False
+
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        i = bisect.bisect_right(indice.keyframes, start_frame) - 1
+        while i > 0:
+            segundo = (indice.pts[indice.keyframes[i]] - indice.inicio_pts) * indice.time_base
+            cap.set(cv2.CAP_PROP_POS_FRAMES, round(segundo * fps))
+
+            anterior = -1
+            while cap.grab():
+                pts = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000 / indice.time_base + indice.inicio_pts
+                frame_num = _frame_de_pts(indice, pts)
+                # Un timestamp que no avanza indica que no se puede confiar en él
+                if frame_num <= anterior or frame_num > start_frame:
+                    break
+                if frame_num == start_frame:
+                    return True
+                anterior = frame_num
+            i -= 1
+
+        cap.open(video_path)
+
+    for _ in range(start_frame + 1):
+        if not cap.grab():
+            return False
+    return True
+
+
+def indice_frames(video_path: str):
+    """
+    Numera los frames de un video a partir de los PTS de sus paquetes, sin decodificarlos.
+
+    El número de cada frame es su posición entre los PTS ordenados, que es el número que le asigna OpenCV al
+    decodificar desde el inicio. Calcularlo como PTS × fps promedio solo coincide en videos de frame rate
+    constante: con frame rate variable saltea o repite números.
+
+    Args:
+        video_path (str): Ruta al archivo de video.
+
+    Returns:
+        IndiceFrames: PTS ordenados (numpy), números de los keyframes, time base y PTS inicial del stream y
+            segundo inicial del archivo.
+    """
+    estado = os.stat(video_path)
+    return _indice_frames(os.path.abspath(video_path), estado.st_size, estado.st_mtime_ns)
+
+
+@lru_cache(maxsize=4)
+def _indice_frames(video_path: str, tamano: int, modificado: int):
+    try:
+        import av
+    except ImportError:
+        raise ImportError("Indexar los frames requiere el paquete 'av' (pip install av).")
+
+    pts, pts_keyframes = [], []
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        for packet in container.demux(stream):
+            # El último paquete de demux() es vacío y solo sirve para vaciar el decodificador
+            if packet.size == 0:
+                continue
+            marca = packet.pts if packet.pts is not None else packet.dts
+            if marca is None:
+                continue
+            pts.append(marca)
+            if packet.is_keyframe:
+                pts_keyframes.append(marca)
+
+        pts = np.sort(np.array(pts, dtype=np.int64))
+        keyframes = sorted(set(np.searchsorted(pts, pts_keyframes).tolist()))
+        inicio_archivo = container.start_time / av.time_base if container.start_time is not None else 0.0
+        return IndiceFrames(pts, keyframes, float(stream.time_base), stream.start_time or 0, inicio_archivo)
+
+
+def _indice_opcional(video_path: str):
+    """
+    Devuelve el índice de frames del video, o None si PyAV no está instalado.
+    """
+    try:
+        return indice_frames(video_path)
+    except ImportError:
+        return None
+
+
+def _frame_de_pts(indice: IndiceFrames, pts: float):
+    """
+    Número del frame cuyo PTS es el más cercano al indicado.
+    """
+    i = int(np.searchsorted(indice.pts, pts))
+    if i == len(indice.pts) or (i > 0 and pts - indice.pts[i - 1] < indice.pts[i] - pts):
+        i -= 1
+    return i
+
+
+def _keyframe_anterior(indice: IndiceFrames, frame: int):
+    """
+    Número del último keyframe que no supera al frame indicado.
+    """
+    i = bisect.bisect_right(indice.keyframes, frame) - 1
+    return indice.keyframes[i] if i >= 0 else 0
+
+
+def _iterar_frames_pyav(video_path: str, start_frame: int, end_frame: int, formato: str, escala: float, hilos: int):
+    try:
+        import av
+    except ImportError:
+        raise ImportError("El backend 'pyav' requiere el paquete 'av' (pip install av).")
+
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        # Decodificación multihilo a nivel de códec (por frames y por slices)
+        stream.thread_type = 'AUTO'
+        stream.codec_context.thread_count = hilos
+
+        ancho, alto = dimensiones_escaladas(stream.codec_context.width, stream.codec_context.height, escala)
+        indice = indice_frames(video_path)
+
+        # Búsqueda exacta: se salta al keyframe anterior al frame pedido y se descartan los frames
+        # decodificados hasta alcanzarlo, numerándolos por su posición en el índice
+        frame_num = 0
+        if start_frame > 0:
+            keyframe = _keyframe_anterior(indice, start_frame)
+            container.seek(int(indice.pts[keyframe]), stream=stream, backward=True, any_frame=False)
+            frame_num = keyframe
+
+        for frame in container.decode(stream):
+            if frame.pts is not None:
+                frame_num = _frame_de_pts(indice, frame.pts)
+            if frame_num < start_frame:
+                frame_num += 1
+                continue
+            if frame_num >= end_frame:
+                break
+
+            yield frame_num, frame.to_ndarray(format=_FORMATOS_PYAV[formato], width=ancho, height=alto)
+            frame_num += 1
+
+
+def _iterar_frames_ffmpeg(video_path: str, start_frame: int, end_frame: int, formato: str, escala: float, hilos: int):
+    info = obtener_info_video(video_path)
+    ancho, alto = dimensiones_escaladas(info['ancho'], info['alto'], escala)
+    bytes_por_frame = ancho * alto * _CANALES[formato]
+
+    comando = ['ffmpeg', '-nostdin', '-v', 'error', '-threads', str(hilos)]
+    if start_frame > 0:
+        # '-ss' antes de '-i' busca el keyframe previo y descarta por PTS los frames anteriores; se apunta
+        # entre el frame pedido y el anterior para no perder el pedido por redondeo
+        indice = _indice_opcional(video_path)
+        if indice is not None and start_frame < len(indice.pts):
+            pts_medio = (indice.pts[start_frame - 1] + indice.pts[start_frame]) / 2
+            segundo = pts_medio * indice.time_base - indice.inicio_archivo
+        else:
+            # Sin PyAV se supone frame rate constante
+            segundo = (start_frame - 0.5) / info["fps"]
+        comando += ['-ss', f'{segundo:.6f}']
+    comando += ['-i', video_path, '-map', '0:v:0', '-vsync', 'passthrough']
+    if end_frame != sys.maxsize:
+        comando += ['-frames:v', str(end_frame - start_frame)]
+    if escala != 1.0:
+        comando += ['-vf', f'scale={ancho}:{alto}:flags=area']
+    comando += ['-f', 'rawvideo', '-pix_fmt', _FORMATOS_FFMPEG[formato], 'pipe:1']
+
+    forma = (alto, ancho) if formato == 'gray' else (alto, ancho, 3)
+    proceso = subprocess.Popen(comando, stdout=subprocess.PIPE, bufsize=bytes_por_frame)
+    frame_num = start_frame
+
+    try:
+        while frame_num < end_frame:
+            # Leer directamente en un arreglo escribible, sin pasar por un objeto bytes intermedio
+            frame = np.empty(forma, dtype=np.uint8)
+            vista = memoryview(frame).cast('B')
+            leidos = 0
+            while leidos < bytes_por_frame:
+                n = proceso.stdout.readinto(vista[leidos:])
+                if not n:
+                    break
+                leidos += n
+            if leidos < bytes_por_frame:
+                break
+
+            yield frame_num, frame
+            frame_num += 1
+    finally:
+        proceso.stdout.close()
+        proceso.kill()
+        proceso.wait()
+
+
+def listar_keyframes(video_path: str):
+    """
+    Lista los números de frame de los keyframes del video leyendo solo los paquetes, sin decodificar.
+
+    Args:
+        video_path (str): Ruta al archivo de video.
+
+    Returns:
+        list: Números de frame de los keyframes, en orden.
+    """
+    return list(indice_frames(video_path).keyframes)
+
+
+def medir_decodificacion(video_path: str, backend: str, max_frames: int = 500, formato: str = None,
+                         escala: float = 1.0, hilos: int = 0):
+    """
+    Mide la velocidad de decodificación de un backend sobre los primeros frames de un video.
+
+    Args:
+        video_path (str): Ruta al archivo de video.
+        backend (str): Backend a medir.
+        max_frames (int): Cantidad máxima de frames a decodificar.
+        formato (str): Formato de pixel pedido al backend.
+        escala (float): Factor de escala aplicado durante la decodificación.
+        hilos (int): Hilos del decodificador.
+
+    Returns:
+        dict: Diccionario con 'backend', 'frames', 'segundos' y 'fps'.
+    """
+    inicio = time.time()
+    frames = 0
+    for _ in iterar_frames(video_path, 0, max_frames, backend, formato, escala, hilos):
+        frames += 1
+    segundos = time.time() - inicio
+    return {
+        'backend': backend,
+        'frames': frames,
+        'segundos': segundos,
+        'fps': frames / segundos if segundos > 0 else 0.0
+    }
+
+
+@click.command()
+@click.option('--video-path', required=True, type=str, help='Ruta al archivo de video')
+@click.option('--backend', 'backends', multiple=True, type=click.Choice(BACKENDS, case_sensitive=False), help='Backends a comparar (por defecto todos)')
+@click.option('--max-frames', type=int, default=500, help='Cantidad de frames a decodificar por backend')
+@click.option('--formato', type=click.Choice(list(_CANALES), case_sensitive=False), default=None, help='Formato de pixel pedido (por defecto el nativo de cada backend)')
+@click.option('--escala', type=float, default=1.0, help='Factor de escala aplicado durante la decodificación')
+@click.option('--hilos', type=int, default=0, help='Hilos del decodificador (0 = automático)')
+def main(video_path: str, backends: tuple, max_frames: int, formato: str, escala: float, hilos: int):
+    """
+    Compara la velocidad de decodificación de los distintos backends sobre el mismo video.
+    """
+    for backend in backends or BACKENDS:
+        try:
+            resultado = medir_decodificacion(video_path, backend, max_frames, formato, escala, hilos)
+        except (ImportError, FileNotFoundError) as e:
+            print(f"{backend}: no disponible ({e})")
+            continue
+        print(f"{resultado['backend']}: {resultado['frames']} frames en {resultado['segundos']:.2f} segundos "
+              f"({resultado['fps']:.1f} frames/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
-import cv2
-import sys
 import multiprocessing
-from pyzbar.pyzbar import decode
+from zbar_decoder import decode
+from utils import dividir_en_rangos_alineados
+from progreso import MonitorProgreso, inicializar_proceso, registrar
+from video_decoding import iterar_frames, obtener_info_video
 
 
-def procesar_frame_range(video_path: str, log_path: str, start_frame: int, end_frame: int):
+def procesar_frame_range(video_path: str, log_path: str, start_frame: int, end_frame: int,
+                         backend: str = 'opencv', escala: float = 1.0, hilos: int = 0):
     """
     Procesa un rango de frames de un video para detectar códigos QR con mayor precisión.
 
@@ -13,21 +15,17 @@ def procesar_frame_range(video_path: str, log_path: str, start_frame: int, end_f
         log_path (str): Ruta al archivo de log para registrar errores.
         start_frame (int): Frame inicial para comenzar el procesamiento.
         end_frame (int): Frame final hasta donde se debe procesar.
+        backend (str): Backend de decodificación ('opencv', 'pyav' o 'ffmpeg').
+        escala (float): Factor de escala aplicado durante la decodificación.
+        hilos (int): Hilos del decodificador (0 = automático).
 
     Returns:
         list: Lista de diccionarios con información sobre los códigos QR detectados.
     """
     datos = []
-    cap = cv2.VideoCapture(video_path)
-    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
-    
-    frame_num = start_frame
-
-    while frame_num < end_frame and cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
 
+    for frame_num, frame in iterar_frames(video_path, start_frame, end_frame, backend, escala=escala, hilos=hilos):
+        detectados = len(datos)
         try:
             # Detectar los códigos QR utilizando pyzbar
             qrs = decode(frame)
@@ -36,7 +34,8 @@ def procesar_frame_range(video_path: str, log_path: str, start_frame: int, end_f
                 # Obtener las esquinas del polígono del QR
                 polygon = qr.polygon
                 if len(polygon) == 4:  # Asegurarse de que sea un cuadrilátero
-                    points = [(point.x, point.y) for point in polygon]
+                    # Volver a las coordenadas de la resolución original
+                    points = [(int(round(point.x / escala)), int(round(point.y / escala))) for point in polygon]
                 else:
                     continue  # Saltar si no es un cuadrilátero
 
@@ -47,7 +46,11 @@ def procesar_frame_range(video_path: str, log_path: str, start_frame: int, end_f
                 datos.append({
                     'frame': frame_num,
                     'data': data,
-                    'points': points  # Las cuatro esquinas del QR
+                    'x1': points[0][0], 'y1': points[0][1],
+                    'x2': points[1][0], 'y2': points[1][1],
+                    'x3': points[2][0], 'y3': points[2][1],
+                    'x4': points[3][0], 'y4': points[3][1],
+                    'detected_by': 'pyzbar'
                 })
 
         except Exception as e:
@@ -55,13 +58,15 @@ def procesar_frame_range(video_path: str, log_path: str, start_frame: int, end_f
             with open(log_path, 'a') as log_file:
                 log_file.write(f'Error en el frame {frame_num}: {str(e)}\n')
 
-        frame_num += 1
+        # El frame completo cuenta como un único parche escaneado
+        registrar(1, 1, len(datos) - detectados)
 
-    cap.release()
     return datos
 
 
-def procesar_video_parallel(video_path: str, log_path: str, num_processes: int = 4):
+def procesar_video_parallel(video_path: str, log_path: str, num_processes: int = 4,
+                            backend: str = 'opencv', escala: float = 1.0, hilos: int = 0,
+                            tamano_chunk: int = None, hilos_opencv: int = None, progreso_jsonl: str = None):
     """
     Procesa un video en paralelo utilizando múltiples procesos para detectar códigos QR.
 
@@ -69,26 +74,31 @@ def procesar_video_parallel(video_path: str, log_path: str, num_processes: int =
         video_path (str): Ruta al archivo de video.
         log_path (str): Ruta al archivo de log para registrar errores.
         num_processes (int): Número de procesos a utilizar para la ejecución paralela.
+        backend (str): Backend de decodificación ('opencv', 'pyav' o 'ffmpeg').
+        escala (float): Factor de escala aplicado durante la decodificación.
+        hilos (int): Hilos del decodificador en cada proceso (0 = automático).
+        tamano_chunk (int): Si se indica, el video se divide en chunks de este tamaño que se asignan dinámicamente
+            a los procesos libres; si no, cada proceso recibe un único rango.
+        hilos_opencv (int): Hilos internos de OpenCV en cada proceso (None = valor por defecto de OpenCV).
+        progreso_jsonl (str): Archivo al que se agregan los eventos de progreso en formato JSONL (opcional).
 
     Returns:
         list: Lista de diccionarios con información sobre los códigos QR detectados.
     """
-    cap = cv2.VideoCapture(video_path)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    cap.release()
+    total_frames = obtener_info_video(video_path)['total_frames']
 
-    frame_ranges = [(i * (total_frames // num_processes), (i + 1) * (total_frames // num_processes)) for i in range(num_processes)]
-    frame_ranges[-1] = (frame_ranges[-1][0], total_frames)  # Asegurarse de que el último proceso llegue hasta el final
+    frame_ranges = dividir_en_rangos_alineados(video_path, total_frames, num_processes, tamano_chunk)
 
     # Mostrar mensaje inicial
     print(f"Procesando video con {num_processes} núcleos...")
 
-    # Crear procesos y recolectar resultados
-    pool = multiprocessing.Pool(processes=num_processes)
-    results = pool.starmap(procesar_frame_range, [(video_path, log_path, start, end) for start, end in frame_ranges])
+    # Crear procesos y recolectar resultados mientras se muestra el progreso
+    with MonitorProgreso(total_frames, num_processes, progreso_jsonl, etiqueta=video_path) as monitor:
+        pool = multiprocessing.Pool(processes=num_processes, initializer=inicializar_proceso, initargs=monitor.initargs(hilos_opencv))
+        results = pool.starmap(procesar_frame_range, [(video_path, log_path, start, end, backend, escala, hilos) for start, end in frame_ranges], chunksize=1)
 
-    pool.close()
-    pool.join()
+        pool.close()
+        pool.join()
 
     # Unir los resultados de todos los procesos
     datos = [item for sublist in results for item in sublist]
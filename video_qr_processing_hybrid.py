@@ -4,8 +4,12 @@ import os
 import shutil
 import numpy as np
 import multiprocessing
-from pyzbar.pyzbar import decode
-from utils import mide_tiempo
+from concurrent.futures import ThreadPoolExecutor
+from zbar_decoder import decode
+from utils import mide_tiempo, dividir_en_rangos_alineados
+from progreso import MonitorProgreso, inicializar_proceso, registrar
+from video_decoding import iterar_frames, obtener_info_video
+from roi import grilla_parches, SeleccionParches
 
 
 def es_rectangulo_valido(points):
@@ -48,7 +52,70 @@ def es_rectangulo_valido(points):
     return True
 
 
-def procesar_frame_range(video_path: str, log_path: str, start_frame: int, end_frame: int, output:str, borde: int = 15, tamano_parche: int = 300):
+def procesar_parche(frame, x: int, y: int, tamano_parche: int, borde: int):
+    """
+    Detecta los códigos QR de un parche del frame y refina sus esquinas con OpenCV.
+
+    No modifica el frame, por lo que varios parches del mismo frame pueden procesarse en paralelo
+    desde distintos hilos: pyzbar y OpenCV liberan el GIL mientras decodifican.
+
+    Args:
+        frame (numpy.ndarray): Frame completo.
+        x (int): Coordenada x de la esquina superior izquierda del parche.
+        y (int): Coordenada y de la esquina superior izquierda del parche.
+        tamano_parche (int): Lado del parche en píxeles.
+        borde (int): Tamaño del borde adicional para el recorte del área del QR.
+
+    Returns:
+        list: Lista de tuplas (data, puntos) con las esquinas de cada QR en coordenadas del frame.
+    """
+    height, width = frame.shape[:2]
+    resultados = []
+
+    # Definir los límites del parche
+    x_end = min(x + tamano_parche, width)
+    y_end = min(y + tamano_parche, height)
+
+    # Extraer el parche
+    parche = frame[y:y_end, x:x_end]
+
+    # Detectar los códigos QR utilizando pyzbar en el parche
+    qrs = decode(parche)
+
+    for qr in qrs:
+        # Bounding box del QR (esquina superior izquierda y dimensiones)
+        (px, py, pw, ph) = qr.rect
+
+        # Expandir el área del QR para mejorar la detección de esquinas, con un borde adicional de 'borde' píxeles
+        x_start = max(0, x + px - borde)
+        y_start = max(0, y + py - borde)
+        x_final = min(width, x + px + pw + borde)
+        y_final = min(height, y + py + ph + borde)
+
+        # Recortar la región del QR
+        qr_region = frame[y_start:y_final, x_start:x_final].copy()
+
+        data = qr.data.decode('utf-8')
+
+        # Usar OpenCV para encontrar las esquinas exactas del QR en la región recortada
+        qr_detector = cv2.QRCodeDetector()
+        retval, points = qr_detector.detect(qr_region)
+
+        if retval and points is not None:
+            points = points[0]  # points tiene una dimensión adicional que contiene los puntos
+
+            # Validar si los puntos forman un rectángulo válido
+            if es_rectangulo_valido(points):
+                # Convertir los puntos a coordenadas relativas a la imagen completa
+                puntos_qr = [(int(point[0]) + x_start, int(point[1]) + y_start) for point in points]
+                resultados.append((data, puntos_qr))
+
+    return resultados
+
+
+def procesar_frame_range(video_path: str, log_path: str, start_frame: int, end_frame: int, output:str, borde: int = 15, tamano_parche: int = 300,
+                         backend: str = 'opencv', escala: float = 1.0, hilos: int = 0, seleccion: SeleccionParches = None,
+                         hilos_parches: int = 1):
     """
     Procesa un rango de frames de un video para detectar códigos QR de manera híbrida:
     1. Usa pyzbar para detectar códigos QR dividiendo la imagen en parches más pequeños.
@@ -62,105 +129,96 @@ def procesar_frame_range(video_path: str, log_path: str, start_frame: int, end_f
         end_frame (int): Frame final hasta donde se debe procesar.
         borde (int): Tamaño del borde adicional para el recorte del área del QR (valor por defecto 15).
         tamano_parche (int): Tamaño del parche en el cual se dividirá cada frame (valor por defecto 200).
+        backend (str): Backend de decodificación ('opencv', 'pyav' o 'ffmpeg').
+        escala (float): Factor de escala aplicado durante la decodificación. El parche y el borde se escalan en
+            la misma proporción y las esquinas se devuelven en coordenadas de la resolución original.
+        hilos (int): Hilos del decodificador (0 = automático).
+        seleccion (SeleccionParches): Máscaras de interés y mapa de calor que limitan los parches a decodificar.
+        hilos_parches (int): Hilos que decodifican en paralelo los parches de cada frame (1 = secuencial).
+
+    Los frames de `qr_frames` se guardan en color y en la resolución original aunque se decodifique en escala
+    de grises o con otra escala.
 
     Returns:
         list: Lista de diccionarios con información sobre los códigos QR detectados.
     """
     datos = []
     os.makedirs(f'{output}/qr_frames/', exist_ok=True)
-    cap = cv2.VideoCapture(video_path)    
-    frame_num = 0
-
-    while frame_num < end_frame and cap.isOpened():
-
-        ret, frame = cap.read()
-
-        if frame_num < start_frame:
-            frame_num += 1
-            continue
-            
-        if not ret:
-            if not ret:
-                print(f"Error al leer el frame {frame_num}.")
-                frame_num += 1
-                continue
-          
-        try:
-            # Dividir el frame en parches más pequeños
-            height, width, _ = frame.shape
-            for y in range(0, height, tamano_parche):
-                for x in range(0, width, tamano_parche):
-                    # Definir los límites del parche
-                    x_end = min(x + tamano_parche, width)
-                    y_end = min(y + tamano_parche, height)
-
-                    # Extraer el parche
-                    parche = frame[y:y_end, x:x_end]
-
-                    # Detectar los códigos QR utilizando pyzbar en el parche
-                    qrs = decode(parche)
-
-                    for qr in qrs:
-                        # Bounding box del QR (esquina superior izquierda y dimensiones)
-                        (px, py, pw, ph) = qr.rect
-
-                        # Expandir el área del QR para mejorar la detección de esquinas, con un borde adicional de 'borde' píxeles
-                        x_start = max(0, x + px - borde)
-                        y_start = max(0, y + py - borde)
-                        x_final = min(width, x + px + pw + borde)
-                        y_final = min(height, y + py + ph + borde)
-
-                        # Recortar la región del QR
-                        qr_region = frame[y_start:y_final, x_start:x_final].copy()
-
-                        # Guardar la región en disco para verificación
-                        data = qr.data.decode('utf-8')
-
-                        # Usar OpenCV para encontrar las esquinas exactas del QR en la región recortada
-                        qr_detector = cv2.QRCodeDetector()
-                        retval, points = qr_detector.detect(qr_region)
-
-                        if retval and points is not None:
-                            # Dibujar los puntos detectados por OpenCV antes de la conversión a coordenadas globales
-                            points = points[0]  # points tiene una dimensión adicional que contiene los puntos
-
-                            # Validar si los puntos forman un rectángulo válido
-                            if es_rectangulo_valido(points):
-                                # Convertir los puntos a coordenadas relativas a la imagen completa
-                                puntos_qr = [(int(point[0]) + x_start, int(point[1]) + y_start) for point in points]
-
-                                # Dibujar los puntos en el frame completo
-                                for punto in puntos_qr:
-                                    cv2.circle(frame, punto, radius=5, color=(0, 0, 255), thickness=-1)  # Rojo para los puntos detectados
-                                cv2.putText(frame, data, (puntos_qr[0][0] - 10, puntos_qr[0][1] - 10),
-                                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1, cv2.LINE_AA)
-
-                                # Añadir la información del QR detectado con OpenCV
-                                datos.append({
-                                    'frame': frame_num,
-                                    'data': data,
-                                    'x1': puntos_qr[0][0], 'y1': puntos_qr[0][1],
-                                    'x2': puntos_qr[1][0], 'y2': puntos_qr[1][1],
-                                    'x3': puntos_qr[2][0], 'y3': puntos_qr[2][1],
-                                    'x4': puntos_qr[3][0], 'y4': puntos_qr[3][1],
-                                    'detected_by': 'opencv'
-                                })
-
-        except Exception as e:
-            # Registrar cualquier error en el archivo de log
-            with open(log_path, 'a') as log_file:
-                log_file.write(f'Error en el frame {frame_num}: {str(e)}\n')
-
-        # Guardar el frame completo con los puntos dibujados si ha sido modificado
-        cv2.imwrite(f'{output}/qr_frames/frame_completo_{frame_num}.png', frame)
-
-        frame_num += 1
-
-    cap.release()
+    info = obtener_info_video(video_path)
+
+    # El parche y el borde se expresan en píxeles de la resolución original
+    tamano_parche = max(1, int(round(tamano_parche * escala)))
+    borde = int(round(borde * escala))
+
+    executor = ThreadPoolExecutor(max_workers=hilos_parches) if hilos_parches > 1 else None
+
+    try:
+        # Con OpenCV se busca desde el keyframe anterior identificando cada frame por su timestamp,
+        # para que los números de frame no dependan de la precisión de CAP_PROP_POS_FRAMES
+        for frame_num, frame in iterar_frames(video_path, start_frame, end_frame, backend, escala=escala, hilos=hilos,
+                                              busqueda_exacta=True):
+            detectados = len(datos)
+            parches = []
+            # Copia en color y en la resolución original sobre la que se dibujan los QR detectados
+            imagen = frame if frame.ndim == 3 else cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            if escala != 1.0:
+                imagen = cv2.resize(imagen, (info['ancho'], info['alto']))
+            try:
+                # Dividir el frame en parches más pequeños
+                height, width = frame.shape[:2]
+                # Recorrer solo los parches seleccionados (todos si no hay máscaras ni mapa de calor)
+                if seleccion is None:
+                    parches = grilla_parches(width, height, tamano_parche)
+                else:
+                    parches = seleccion.parches_para_frame(frame_num, width, height, tamano_parche, escala)
+
+                # Decodificar los parches (en paralelo si hay varios hilos); map conserva el orden de los parches
+                def procesar(parche):
+                    return procesar_parche(frame, parche[0], parche[1], tamano_parche, borde)
+                resultados = list(executor.map(procesar, parches) if executor else map(procesar, parches))
+
+                # Dibujar y registrar una vez decodificados todos los parches, para no modificar el frame mientras se lee
+                for data, puntos_qr in [resultado for resultados_parche in resultados for resultado in resultados_parche]:
+                    # Las esquinas del QR detectado con OpenCV, en la resolución original
+                    puntos_originales = [(int(round(px_ / escala)), int(round(py_ / escala))) for px_, py_ in puntos_qr]
+
+                    # Dibujar los puntos en el frame completo
+                    for punto in puntos_originales:
+                        cv2.circle(imagen, punto, radius=5, color=(0, 0, 255), thickness=-1)  # Rojo para los puntos detectados
+                    cv2.putText(imagen, data, (puntos_originales[0][0] - 10, puntos_originales[0][1] - 10),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1, cv2.LINE_AA)
+
+                    # Añadir la información del QR detectado
+                    datos.append({
+                        'frame': frame_num,
+                        'data': data,
+                        'x1': puntos_originales[0][0], 'y1': puntos_originales[0][1],
+                        'x2': puntos_originales[1][0], 'y2': puntos_originales[1][1],
+                        'x3': puntos_originales[2][0], 'y3': puntos_originales[2][1],
+                        'x4': puntos_originales[3][0], 'y4': puntos_originales[3][1],
+                        'detected_by': 'opencv'
+                    })
+
+            except Exception as e:
+                # Registrar cualquier error en el archivo de log
+                with open(log_path, 'a') as log_file:
+                    log_file.write(f'Error en el frame {frame_num}: {str(e)}\n')
+
+            # Guardar el frame completo con los puntos dibujados si ha sido modificado
+            cv2.imwrite(f'{output}/qr_frames/frame_completo_{frame_num}.png', imagen)
+
+            registrar(1, len(parches), len(datos) - detectados)
+    finally:
+        # Liberar los hilos también si la decodificación del video falla
+        if executor:
+            executor.shutdown()
     return datos
 
 @mide_tiempo
-def procesar_video_parallel(video_path: str, log_path: str, output_path: str, num_processes: int = 4, borde: int = 15):
+def procesar_video_parallel(video_path: str, log_path: str, output_path: str, num_processes: int = 4, borde: int = 15,
+                            backend: str = 'opencv', escala: float = 1.0, hilos: int = 0,
+                            tamano_chunk: int = None, hilos_opencv: int = None, seleccion: SeleccionParches = None,
+                            hilos_parches: int = 1, progreso_jsonl: str = None):
     """
     Procesa un video en paralelo utilizando múltiples procesos para detectar códigos QR de manera híbrida.
 
@@ -169,6 +227,15 @@ def procesar_video_parallel(video_path: str, log_path: str, output_path: str, nu
         log_path (str): Ruta al archivo de log para registrar errores.
         num_processes (int): Número de procesos a utilizar para la ejecución paralela.
         borde (int): Tamaño del borde adicional para el recorte del área del QR (valor por defecto 15).
+        backend (str): Backend de decodificación ('opencv', 'pyav' o 'ffmpeg').
+        escala (float): Factor de escala aplicado durante la decodificación.
+        hilos (int): Hilos del decodificador en cada proceso (0 = automático).
+        tamano_chunk (int): Si se indica, el video se divide en chunks de este tamaño que se asignan dinámicamente
+            a los procesos libres; si no, cada proceso recibe un único rango.
+        hilos_opencv (int): Hilos internos de OpenCV en cada proceso (None = valor por defecto de OpenCV).
+        seleccion (SeleccionParches): Máscaras de interés y mapa de calor que limitan los parches a decodificar.
+        hilos_parches (int): Hilos por proceso que decodifican en paralelo los parches de cada frame.
+        progreso_jsonl (str): Archivo al que se agregan los eventos de progreso en formato JSONL (opcional).
 
     Returns:
         list: Lista de diccionarios con información sobre los códigos QR detectados.
@@ -178,12 +245,9 @@ def procesar_video_parallel(video_path: str, log_path: str, output_path: str, nu
         shutil.rmtree('regiones')
     os.makedirs('regiones')
 
-    cap = cv2.VideoCapture(video_path)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    cap.release()
+    total_frames = obtener_info_video(video_path)['total_frames']
 
-    frame_ranges = [(i * (total_frames // num_processes), (i + 1) * (total_frames // num_processes)) for i in range(num_processes)]    
-    frame_ranges[-1] = (frame_ranges[-1][0], total_frames)  # Asegurarse de que el último proceso llegue hasta el final
+    frame_ranges = dividir_en_rangos_alineados(video_path, total_frames, num_processes, tamano_chunk)
 
     # # Imprimir los rangos generados
     # print("Rangos de frames asignados a los procesos:")
@@ -191,14 +255,15 @@ def procesar_video_parallel(video_path: str, log_path: str, output_path: str, nu
     #     print(f"Proceso {i}: Frames {start} a {end - 1}")
 
     # Mostrar mensaje inicial
-    print(f"Procesando video con {num_processes} núcleos...")
+    print(f"Procesando video con {num_processes} procesos × {hilos_parches} hilos...")
 
-    # Crear procesos y recolectar resultados
-    pool = multiprocessing.Pool(processes=num_processes)
-    results = pool.starmap(procesar_frame_range, [(video_path, log_path, start, end, output_path, borde) for start, end in frame_ranges])
+    # Crear procesos y recolectar resultados mientras se muestra el progreso
+    with MonitorProgreso(total_frames, num_processes, progreso_jsonl, etiqueta=video_path) as monitor:
+        pool = multiprocessing.Pool(processes=num_processes, initializer=inicializar_proceso, initargs=monitor.initargs(hilos_opencv))
+        results = pool.starmap(procesar_frame_range, [(video_path, log_path, start, end, output_path, borde, 300, backend, escala, hilos, seleccion, hilos_parches) for start, end in frame_ranges], chunksize=1)
 
-    pool.close()
-    pool.join()
+        pool.close()
+        pool.join()
 
     # Unir los resultados de todos los procesos
     datos = [item for sublist in results for item in sublist]
@@ -0,0 +1,173 @@
+import threading
+import cv2
+import numpy as np
+import click
+from ctypes import c_void_p
+from concurrent.futures import ThreadPoolExecutor
+from pyzbar import pyzbar
+from pyzbar.pyzbar import ZBarSymbol, _FOURCC, _decode_symbols, _symbols_for_image
+from pyzbar.pyzbar_error import PyZbarError
+from video_decoding import iterar_frames
+from roi import grilla_parches
+from pyzbar.wrapper import (
+    zbar_image_scanner_create, zbar_image_scanner_destroy, zbar_image_scanner_set_config,
+    zbar_image_create, zbar_image_destroy, zbar_image_set_format, zbar_image_set_size,
+    zbar_image_set_data, zbar_scan_image, ZBarConfig,
+)
+
+
+class DecodificadorZbar:
+    """
+    Decodificador que reutiliza un mismo scanner e imagen de zbar entre llamadas.
+
+    `pyzbar.decode` crea y configura un scanner y una imagen por llamada y copia los píxeles en un objeto
+    bytes nuevo. Este decodificador los crea una sola vez y le pasa a zbar directamente la memoria del
+    arreglo: sin copia si el arreglo ya es de un canal y contiguo, o con una única copia a un buffer
+    reutilizado si es una vista con saltos (un parche de un frame) o tiene varios canales.
+
+    zbar no admite saltos entre filas, por lo que un parche que no ocupa el ancho completo del frame no
+    puede pasarse sin esa copia. Una instancia no debe compartirse entre hilos (ver `decodificador_del_hilo`).
+    """
+
+    def __init__(self, simbolos=(ZBarSymbol.QRCODE,)):
+        self._scanner = zbar_image_scanner_create()
+        if not self._scanner:
+            raise PyZbarError('Could not create image scanner')
+        self._imagen = zbar_image_create()
+        if not self._imagen:
+            zbar_image_scanner_destroy(self._scanner)
+            raise PyZbarError('Could not create zbar image')
+
+        # Habilitar solo los símbolos de interés, igual que pyzbar.decode(image, symbols=...)
+        zbar_image_scanner_set_config(self._scanner, ZBarSymbol.NONE, ZBarConfig.CFG_ENABLE, 0)
+        for simbolo in simbolos:
+            zbar_image_scanner_set_config(self._scanner, simbolo, ZBarConfig.CFG_ENABLE, 1)
+        zbar_image_set_format(self._imagen, _FOURCC['L800'])
+
+        self._buffer = np.empty(0, dtype=np.uint8)
+        # Referencia al arreglo cuyos píxeles usa zbar, para que siga vivo mientras la imagen lo apunte
+        self._pixeles = None
+
+    def _pixeles_contiguos(self, imagen: np.ndarray):
+        """
+        Devuelve un arreglo de un canal, uint8 y contiguo con el contenido de la imagen, copiando solo si hace falta.
+        """
+        if imagen.ndim == 3:
+            # Igual que pyzbar, se usa solo el primer canal
+            imagen = imagen[:, :, 0]
+        if imagen.dtype == np.uint8 and imagen.flags.c_contiguous:
+            return imagen
+
+        alto, ancho = imagen.shape
+        if self._buffer.size < alto * ancho:
+            self._buffer = np.empty(alto * ancho, dtype=np.uint8)
+        pixeles = self._buffer[:alto * ancho].reshape(alto, ancho)
+        np.copyto(pixeles, imagen, casting='unsafe')
+        return pixeles
+
+    def decode(self, imagen: np.ndarray):
+        """
+        Decodifica los códigos de una imagen.
+
+        Args:
+            imagen (numpy.ndarray): Imagen en escala de grises (o BGR, de la que se usa el primer canal).
+
+        Returns:
+            list: Lista de `pyzbar.pyzbar.Decoded`, con el mismo formato que `pyzbar.decode`.
+        """
+        pixeles = self._pixeles_contiguos(imagen)
+        alto, ancho = pixeles.shape
+
+        self._pixeles = pixeles
+        zbar_image_set_size(self._imagen, ancho, alto)
+        zbar_image_set_data(self._imagen, c_void_p(pixeles.ctypes.data), pixeles.nbytes, None)
+
+        # zbar_scan_image recicla los símbolos del escaneo anterior de esta imagen
+        if zbar_scan_image(self._scanner, self._imagen) < 0:
+            raise PyZbarError('Unsupported image format')
+        return list(_decode_symbols(_symbols_for_image(self._imagen)))
+
+    def __del__(self):
+        if getattr(self, '_imagen', None):
+            zbar_image_destroy(self._imagen)
+            self._imagen = None
+        if getattr(self, '_scanner', None):
+            zbar_image_scanner_destroy(self._scanner)
+            self._scanner = None
+
+
+_locales = threading.local()
+
+
+def decodificador_del_hilo():
+    """
+    Devuelve el decodificador del hilo actual, creándolo la primera vez.
+
+    Returns:
+        DecodificadorZbar: Decodificador propio del hilo.
+    """
+    decodificador = getattr(_locales, 'decodificador', None)
+    if decodificador is None:
+        decodificador = _locales.decodificador = DecodificadorZbar()
+    return decodificador
+
+
+def decode(imagen: np.ndarray):
+    """
+    Reemplazo de `pyzbar.decode` para códigos QR que reutiliza el decodificador del hilo actual.
+
+    Args:
+        imagen (numpy.ndarray): Imagen en escala de grises o BGR.
+
+    Returns:
+        list: Lista de `pyzbar.pyzbar.Decoded`.
+    """
+    return decodificador_del_hilo().decode(imagen)
+
+
+@click.command()
+@click.option('--video-path', required=True, type=str, help='Ruta al archivo de video')
+@click.option('--max-frames', type=int, default=100, help='Cantidad de frames a comparar')
+@click.option('--tamano-parche', type=int, default=300, help='Lado de los parches en píxeles, como en el modo híbrido')
+@click.option('--hilos', type=int, default=8, help='Hilos que reutilizan sus decodificadores en la última comparación')
+def main(video_path: str, max_frames: int, tamano_parche: int, hilos: int):
+    """
+    Comprueba que `decode` devuelve lo mismo que `pyzbar.decode(..., symbols=[QRCODE])` con la libzbar instalada.
+
+    Compara frames completos en escala de grises (contiguos), parches BGR del frame (vistas con saltos) y,
+    por último, todas las imágenes anteriores decodificadas desde varios hilos que reutilizan su decodificador.
+    """
+    frames = [frame for _, frame in iterar_frames(video_path, 0, max_frames)]
+    grises = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+    parches = [frame[y:y + tamano_parche, x:x + tamano_parche] for frame in frames
+               for x, y in grilla_parches(frame.shape[1], frame.shape[0], tamano_parche)]
+
+    casos = {'frames en gris': grises, 'parches BGR': parches}
+    esperados = {nombre: [pyzbar.decode(imagen, symbols=[ZBarSymbol.QRCODE]) for imagen in imagenes]
+                 for nombre, imagenes in casos.items()}
+
+    diferencias = []
+    for nombre, imagenes in casos.items():
+        obtenidos = [decode(imagen) for imagen in imagenes]
+        distintos = sum(obtenido != esperado for obtenido, esperado in zip(obtenidos, esperados[nombre]))
+        print(f"{nombre}: {len(imagenes)} imágenes, {sum(map(len, esperados[nombre]))} códigos, {distintos} distintas")
+        if distintos:
+            diferencias.append(nombre)
+
+    # Cada hilo reutiliza su decodificador sobre imágenes de ambos tipos, intercaladas con las de los otros hilos
+    imagenes = [imagen for nombre in casos for imagen in casos[nombre]]
+    esperado = [resultado for nombre in casos for resultado in esperados[nombre]]
+    with ThreadPoolExecutor(max_workers=hilos) as executor:
+        obtenidos = list(executor.map(decode, imagenes * 3))
+    distintos = sum(obtenido != e for obtenido, e in zip(obtenidos, esperado * 3))
+    print(f"{hilos} hilos reutilizando el decodificador: {len(obtenidos)} imágenes, {distintos} distintas")
+    if distintos:
+        diferencias.append('hilos')
+
+    if diferencias:
+        raise click.ClickException(f"decode difiere de pyzbar.decode en: {', '.join(diferencias)}")
+    print("OK: decode devuelve los mismos resultados que pyzbar.decode.")
+
+
+if __name__ == "__main__":
+    main()